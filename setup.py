@@ -7,10 +7,11 @@ setup(
     url = "https://github.com/kroesche/emiata-vidlog",
     author = "Joseph Kroesche",
     license = "MIT",
-    python_requires = ">=3.4",
+    python_requires = ">=3.8",
     packages = ["vidlog"],
     install_requires = [
         'opencv-python',
+        'numpy',
         'ffmpeg-python',
         'progress',
         'gopro2gpx @ git+https://github.com/juanmcasillas/gopro2gpx'
@@ -18,7 +19,10 @@ setup(
     entry_points = {
         "console_scripts": [
             "vidlog=vidlog.vidlog:cli",
-            "vidlog-init-config=vidlog:init_config_cli"]
+            "vidlog-init-config=vidlog:init_config_cli",
+            "vidlog-daemon=vidlog.daemon:daemon_cli",
+            "vidlog-tune=vidlog.tune:tune_cli",
+            "vidlog-golden=vidlog.golden:golden_cli"]
     },
     classifiers = [
         "Private :: Do Not Upload"
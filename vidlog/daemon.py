@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: MIT
+#
+# Copyright 2022 Joseph Kroesche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import argparse
+import os
+import sys
+import time
+import signal
+import shutil
+import sqlite3
+import pathlib
+import subprocess
+import logging
+import ffmpeg
+from .vidlog import VidProps, VidLog, LogBuffer, vidlog_command
+
+__all__ = ["JobStore", "RenderDaemon", "daemon_cli"]
+
+_videxts = (".mp4", ".mov")
+_dashexts = (".mkv", ".webm", ".mp4")
+_logexts = (".txt", ".log")
+
+# persistent store of ingested files and render jobs, in a SQLite database
+# everything the daemon knows is kept here, so queued and completed jobs
+# survive a restart of the daemon
+class JobStore(object):
+    _schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            kind TEXT,
+            start REAL,
+            end REAL
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video TEXT UNIQUE,
+            logfile TEXT,
+            dash TEXT,
+            output TEXT,
+            priority INTEGER DEFAULT 0,
+            state TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            maxattempts INTEGER DEFAULT 3,
+            notbefore REAL DEFAULT 0,
+            error TEXT,
+            created REAL,
+            updated REAL
+        );
+        """
+
+    def __init__(self, dbfile):
+        self._dbfile = dbfile
+        self._db = sqlite3.connect(dbfile)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(JobStore._schema)
+        logging.debug("Created JobStore\n" + str(self))
+
+    def __str__(self):
+        desc = "JobStore:\n"
+        desc += f"database: {self._dbfile}\n"
+        for state, count in self.counts().items():
+            desc += f"{state + ':':10}{count}\n"
+        return desc
+
+    def close(self):
+        self._db.close()
+
+    # number of jobs in each state
+    def counts(self):
+        rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        return {row[0]: row[1] for row in rows}
+
+    # jobs that were running when the daemon stopped are queued again
+    def recover(self):
+        with self._db:
+            cur = self._db.execute(
+                "UPDATE jobs SET state='queued', updated=? WHERE state='running'",
+                (time.time(),))
+        if cur.rowcount:
+            logging.info(f"re-queued {cur.rowcount} interrupted jobs")
+
+    def file(self, path):
+        return self._db.execute("SELECT * FROM files WHERE path=?", (path,)).fetchone()
+
+    def add_file(self, path, size, mtime, kind, start=None, end=None):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                             (path, size, mtime, kind, start, end))
+
+    def files(self, kind):
+        return self._db.execute("SELECT * FROM files WHERE kind=? ORDER BY start",
+                                (kind,)).fetchall()
+
+    # videos that do not have a job yet
+    def unmatched_videos(self):
+        return self._db.execute(
+            "SELECT * FROM files WHERE kind='video' AND path NOT IN "
+            "(SELECT video FROM jobs) ORDER BY start").fetchall()
+
+    def add_job(self, video, logfile, dash, output, priority=0, maxattempts=3):
+        now = time.time()
+        with self._db:
+            cur = self._db.execute(
+                "INSERT INTO jobs (video, logfile, dash, output, priority, maxattempts,"
+                " created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (video, logfile, dash, output, priority, maxattempts, now, now))
+        return cur.lastrowid
+
+    def jobs(self):
+        return self._db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+
+    # the highest priority queued job that is ready to run, oldest first
+    def next_job(self):
+        return self._db.execute(
+            "SELECT * FROM jobs WHERE state='queued' AND notbefore<=? "
+            "ORDER BY priority DESC, created LIMIT 1", (time.time(),)).fetchone()
+
+    def set_state(self, jobid, state, error=None):
+        with self._db:
+            self._db.execute("UPDATE jobs SET state=?, error=?, updated=? WHERE id=?",
+                             (state, error, time.time(), jobid))
+
+    def set_priority(self, jobid, priority):
+        with self._db:
+            cur = self._db.execute("UPDATE jobs SET priority=?, updated=? WHERE id=?",
+                                   (priority, time.time(), jobid))
+        return cur.rowcount > 0
+
+    # queue a job again, for example one that failed too many times
+    def retry(self, jobid):
+        with self._db:
+            cur = self._db.execute(
+                "UPDATE jobs SET state='queued', attempts=0, notbefore=0, error=NULL,"
+                " updated=? WHERE id=?", (time.time(), jobid))
+        return cur.rowcount > 0
+
+    # record a failed attempt. the job is queued again after a delay that
+    # grows with each attempt, until it runs out of attempts
+    def failed(self, jobid, error, backoff):
+        job = self._db.execute("SELECT * FROM jobs WHERE id=?", (jobid,)).fetchone()
+        attempts = job['attempts'] + 1
+        if attempts < job['maxattempts']:
+            state = 'queued'
+            notbefore = time.time() + backoff * attempts
+        else:
+            state = 'failed'
+            notbefore = 0
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET state=?, attempts=?, notbefore=?, error=?, updated=?"
+                " WHERE id=?", (state, attempts, notbefore, error, time.time(), jobid))
+        return state
+
+# watches an ingest directory for new video, log and dash files, matches
+# them into render jobs by timestamp, and runs the jobs
+class RenderDaemon(object):
+    def __init__(self, ingest, outdir, store, maxjobs=1, priority=0, maxattempts=3,
+                 interval=30, backoff=300, diskfactor=1.5, minfree=5.0, renderargs=None):
+        self._ingest = pathlib.Path(ingest).resolve()
+        self._outdir = pathlib.Path(outdir).resolve()
+        self._store = store
+        self._maxjobs = maxjobs
+        self._priority = priority
+        self._maxattempts = maxattempts
+        self._interval = interval
+        self._backoff = backoff
+        self._diskfactor = diskfactor
+        self._minfree = minfree * 1e9
+        self._renderargs = renderargs if renderargs else []
+        self._seen = {}
+        self._running = {}
+        self._stop = False
+        logging.debug("Created RenderDaemon\n" + str(self))
+
+    def __str__(self):
+        desc = "RenderDaemon:\n"
+        desc += f"ingest:      {self._ingest}\n"
+        desc += f"output:      {self._outdir}\n"
+        desc += f"max jobs:    {self._maxjobs}\n"
+        desc += f"attempts:    {self._maxattempts}\n"
+        desc += f"interval:    {self._interval} secs\n"
+        desc += f"min free:    {self._minfree / 1e9:.1f} GB\n"
+        return desc
+
+    def stop(self, *args):
+        logging.info("stopping render daemon")
+        self._stop = True
+
+    def run(self):
+        self._outdir.mkdir(parents=True, exist_ok=True)
+        self._store.recover()
+        logging.info(f"watching {self._ingest} for new files")
+        try:
+            while not self._stop:
+                self.scan()
+                self.match()
+                self.reap()
+                self.start_jobs()
+                # sleep in short steps so a stop request is handled quickly
+                wake = time.time() + self._interval
+                while not self._stop and time.time() < wake and not self.reap():
+                    time.sleep(1)
+        finally:
+            # interrupted jobs go back in the queue for the next start
+            for jobid, (proc, _, _) in self._running.items():
+                logging.info(f"stopping job {jobid}")
+                proc.terminate()
+                proc.wait()
+                shutil.rmtree(self.tmpdir(jobid), ignore_errors=True)
+                self._store.set_state(jobid, 'queued')
+            self._running = {}
+
+    # look for new files in the ingest directory. a file is only ingested
+    # once its size and time have not changed since the last scan, so that
+    # files that are still being copied are left alone
+    def scan(self):
+        seen = {}
+        for path in self._ingest.rglob("*"):
+            if not path.is_file() or self._outdir in path.parents:
+                continue
+            if path.suffix.lower() not in _videxts + _dashexts + _logexts:
+                continue
+            stat = path.stat()
+            key = str(path)
+            seen[key] = (stat.st_size, stat.st_mtime)
+            if self._seen.get(key) != seen[key]:
+                continue
+            known = self._store.file(key)
+            if known and (known['size'], known['mtime']) == seen[key]:
+                continue
+            self.ingest(path, *seen[key])
+        self._seen = seen
+
+    # work out what kind of file this is, and the time span it covers
+    def ingest(self, path, size, mtime):
+        kind, start, end = 'other', None, None
+        suffix = path.suffix.lower()
+        try:
+            if suffix in _logexts:
+                start, end = RenderDaemon.log_times(path)
+                kind = 'log'
+            else:
+                probe = ffmpeg.probe(str(path))
+                if 'TIMESTAMP' in probe['format'].get('tags', {}):
+                    start = VidLog.dash_timestamp(str(path))
+                    end = start + float(probe['format']['duration'])
+                    kind = 'dash'
+                elif suffix in _videxts:
+                    props = VidProps(str(path))
+                    start = props.timestamp
+                    end = start + props.duration
+                    kind = 'video'
+        except (RuntimeError, KeyError, ValueError, ffmpeg.Error) as e:
+            logging.warning(f"could not identify {path}: {e}")
+        logging.info(f"ingested {kind} file {path}")
+        self._store.add_file(str(path), size, mtime, kind, start, end)
+
+    # start and end timestamps of a log file
+    # the end is found by reading only the end of the file
+    @staticmethod
+    def log_times(path):
+        lb = LogBuffer(str(path))
+        start = lb.timestamp
+        lb.close()
+        with open(path, "rb") as logfile:
+            logfile.seek(0, os.SEEK_END)
+            logfile.seek(max(0, logfile.tell() - 4096))
+            lines = logfile.read().decode(errors="replace").strip().splitlines()
+        end = datetime.datetime.strptime(lines[-1][:26], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+        return start, end
+
+    # create jobs for videos that have both a log and a dash capture
+    # covering the video. when more than one file matches, the one that
+    # covers the most of the video is used
+    def match(self):
+        logs = self._store.files('log')
+        dashes = self._store.files('dash')
+        for video in self._store.unmatched_videos():
+            logfile = RenderDaemon.best_match(video, logs)
+            dash = RenderDaemon.best_match(video, dashes)
+            if not logfile or not dash:
+                continue
+            output = self._outdir / RenderDaemon.output_name(self._ingest, video)
+            jobid = self._store.add_job(video['path'], logfile['path'], dash['path'],
+                                        str(output), priority=self._priority,
+                                        maxattempts=self._maxattempts)
+            logging.info(f"queued job {jobid} for {video['path']}")
+
+    # videos on different cards can have the same file name, so the output
+    # is named after the path in the ingest directory and the start time
+    @staticmethod
+    def output_name(ingest, video):
+        path = pathlib.Path(video['path'])
+        try:
+            path = path.relative_to(ingest)
+        except ValueError:
+            # ingested from a different directory in an earlier run
+            path = pathlib.Path(path.name)
+        start = datetime.datetime.fromtimestamp(video['start']).strftime("%Y%m%d-%H%M%S")
+        return "_".join(path.parent.parts + (path.stem, start)) + ".mp4"
+
+    @staticmethod
+    def best_match(video, candidates):
+        best = None
+        best_overlap = 0
+        for candidate in candidates:
+            overlap = (min(video['end'], candidate['end'])
+                       - max(video['start'], candidate['start']))
+            if overlap > best_overlap:
+                best = candidate
+                best_overlap = overlap
+        return best
+
+    # check on running jobs, returns true if any job finished
+    def reap(self):
+        finished = False
+        for jobid, (proc, job, logname) in list(self._running.items()):
+            if proc.poll() is None:
+                continue
+            finished = True
+            del self._running[jobid]
+            shutil.rmtree(self.tmpdir(jobid), ignore_errors=True)
+            if proc.returncode == 0:
+                logging.info(f"job {jobid} finished: {job['output']}")
+                self._store.set_state(jobid, 'done')
+            else:
+                error = f"exit code {proc.returncode}, see {logname}"
+                state = self._store.failed(jobid, error, self._backoff)
+                logging.warning(f"job {jobid} failed ({error}), {state}")
+        return finished
+
+    # the number of jobs that can run at the same time is limited by the
+    # max jobs setting, the CPU load, and the free space for the output
+    def start_jobs(self):
+        while not self._stop and len(self._running) < self._maxjobs:
+            if self._running and self.busy():
+                break
+            job = self._store.next_job()
+            if job is None:
+                break
+            if not self.space_for(job):
+                break
+            self.start(job)
+
+    def busy(self):
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return False
+        return load >= os.cpu_count()
+
+    # free space needed by a job is estimated from the size of its video.
+    # running jobs have not written all of their files yet, so the part of
+    # their estimates they have not written is also held back
+    def space_for(self, job):
+        free = shutil.disk_usage(self._outdir).free
+        needed = self._minfree + self.estimate(job['video'])
+        for jobid, (_, running, _) in self._running.items():
+            needed += max(0, self.estimate(running['video']) - self.written(jobid, running))
+        if free < needed:
+            logging.info(f"waiting for free space for job {job['id']}")
+            return False
+        return True
+
+    # a job writes a temporary overlay video about the size of the input,
+    # and then the output, before the temporary video is removed
+    def estimate(self, video):
+        try:
+            return os.path.getsize(video) * (1 + self._diskfactor)
+        except OSError:
+            return 0
+
+    # bytes a running job has written to its output and temporary files
+    def written(self, jobid, job):
+        paths = [pathlib.Path(job['output'])]
+        tmpdir = self.tmpdir(jobid)
+        if tmpdir.is_dir():
+            paths += list(tmpdir.iterdir())
+        total = 0
+        for path in paths:
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    # the temporary files of a job are kept in the output directory, so
+    # that they are on the disk whose free space is checked
+    def tmpdir(self, jobid):
+        return self._outdir / f".job{jobid}.tmp"
+
+    def start(self, job):
+        output = job['output']
+        logname = str(pathlib.Path(output).with_suffix(".log"))
+        args = vidlog_command() + ["--quiet",
+                "-i", job['video'], "-l", job['logfile'], "-d", job['dash'],
+                "-o", output] + self._renderargs
+        logging.info(f"starting job {job['id']}: {job['video']}")
+        logging.debug(" ".join(args))
+        tmpdir = self.tmpdir(job['id'])
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        tmpdir.mkdir()
+        env = dict(os.environ, TMPDIR=str(tmpdir))
+        with open(logname, "at") as joblog:
+            proc = subprocess.Popen(args, stdout=joblog, stderr=subprocess.STDOUT, env=env)
+        self._store.set_state(job['id'], 'running')
+        self._running[job['id']] = (proc, job, logname)
+
+def daemon_cli():
+    parser = argparse.ArgumentParser(description="eMiata Video Render Daemon")
+    parser.add_argument('-v', "--verbose", action="store_true",
+                        help="turn on extra output")
+    parser.add_argument('-q', "--quiet", action="store_true",
+                        help="silence all output")
+    parser.add_argument("--ingest", default=".",
+                        help="directory to watch for new files (default: .)")
+    parser.add_argument("--output-dir", default="processed",
+                        help="directory for the rendered videos (default: processed)")
+    parser.add_argument("--db", default="vidlog-jobs.db",
+                        help="job database file (default: vidlog-jobs.db)")
+    parser.add_argument("--max-jobs", type=int, default=max(1, os.cpu_count() // 8),
+                        help="max number of jobs to run at the same time")
+    parser.add_argument("--priority", type=int, default=0,
+                        help="priority of new jobs, higher runs first (default: 0)")
+    parser.add_argument("--attempts", type=int, default=3,
+                        help="number of times to try a job (default: 3)")
+    parser.add_argument("--interval", type=int, default=30,
+                        help="seconds between ingest directory scans (default: 30)")
+    parser.add_argument("--min-free", type=float, default=5.0,
+                        help="GB of disk space to keep free (default: 5)")
+    parser.add_argument("--config-name", type=str, default="vidlog.ini",
+                        help="config file used for the jobs (default: vidlog.ini)")
+    parser.add_argument("--render-jobs", type=int,
+                        help="overlay renderer processes for each job (default: from profile, or 1)")
+    parser.add_argument("--overlay-cache", metavar="DIR",
+                        help="cache directory for overlay tracks")
+    parser.add_argument("--list", action="store_true",
+                        help="list the jobs and exit")
+    parser.add_argument("--set-priority", nargs=2, type=int, metavar=("JOB", "PRIORITY"),
+                        help="change the priority of a job and exit")
+    parser.add_argument("--retry", type=int, metavar="JOB",
+                        help="queue a job again and exit")
+
+    args = parser.parse_args()
+
+    if args.quiet:
+        loglevel = logging.WARNING
+    elif args.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+    logging.basicConfig(level=loglevel, format="%(levelname)s:%(message)s")
+
+    store = JobStore(args.db)
+
+    if args.list:
+        for job in store.jobs():
+            error = f" ({job['error']})" if job['error'] else ""
+            print(f"{job['id']:4} {job['state']:8} prio {job['priority']:3} "
+                  f"tries {job['attempts']} {job['video']}{error}")
+        sys.exit()
+
+    if args.set_priority:
+        if not store.set_priority(*args.set_priority):
+            parser.error(f"there is no job {args.set_priority[0]}")
+        sys.exit()
+
+    if args.retry is not None:
+        if not store.retry(args.retry):
+            parser.error(f"there is no job {args.retry}")
+        sys.exit()
+
+    renderargs = ["--config-name", os.path.abspath(args.config_name)]
+    # the jobs setting is left to the profile unless it is given
+    if args.render_jobs:
+        renderargs += ["--jobs", str(args.render_jobs)]
+    if args.overlay_cache:
+        renderargs += ["--overlay-cache", os.path.abspath(args.overlay_cache)]
+
+    daemon = RenderDaemon(args.ingest, args.output_dir, store,
+                          maxjobs=max(1, args.max_jobs), priority=args.priority,
+                          maxattempts=max(1, args.attempts), interval=args.interval,
+                          minfree=args.min_free, renderargs=renderargs)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    daemon_cli()
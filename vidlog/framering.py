@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: MIT
+#
+# Copyright 2022 Joseph Kroesche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import logging
+from multiprocessing import shared_memory
+import numpy as np
+
+__all__ = ["FrameRing"]
+
+# a ring of preallocated video frame slots in shared memory
+# the process that creates the ring owns it and is responsible for unlinking
+# it when done. other processes attach to it by name. frames are accessed
+# as numpy arrays that point directly into the shared memory, so frames can
+# be passed between processes by exchanging only the slot index
+class FrameRing(object):
+    def __init__(self, slots, shape, name=None):
+        self._slots = slots
+        self._shape = tuple(shape)
+        size = slots * int(np.prod(self._shape))
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            # processes attaching to an existing ring must not register
+            # it with the resource tracker, or it may be removed when
+            # they exit (python 3.13 and later lets us turn that off)
+            if sys.version_info >= (3, 13):
+                self._shm = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._frames = np.ndarray((slots,) + self._shape, dtype=np.uint8,
+                                  buffer=self._shm.buf)
+        logging.debug("Created FrameRing\n" + str(self))
+
+    def __str__(self):
+        desc = "FrameRing:\n"
+        desc += f"name:     {self.name}\n"
+        desc += f"slots:    {self._slots}\n"
+        desc += f"shape:    {self._shape}\n"
+        desc += f"owner:    {self._owner}\n"
+        return desc
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def shape(self):
+        return self._shape
+
+    # get the frame in a slot as a numpy array. this is a view into the
+    # shared memory, not a copy. callers must not keep the view after
+    # closing the ring
+    def frame(self, slot):
+        return self._frames[slot]
+
+    def close(self):
+        self._frames = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
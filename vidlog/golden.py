@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: MIT
+#
+# Copyright 2022 Joseph Kroesche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import argparse
+import tempfile
+import os
+import sys
+import time
+import pathlib
+import logging
+import queue
+import multiprocessing as mp
+import numpy as np
+import cv2 as cv
+import ffmpeg
+from .vidlog import Config, LogBuffer, VidLog, OverlayPanels, _render_frames
+from .framering import FrameRing
+
+__all__ = ["RenderPath", "ReferencePath", "AlphaTrackPath", "FrameRingPath",
+           "GoldenHarness", "golden_cli"]
+
+# PSNR reported for identical images
+_PSNR_IDENTICAL = 361.0
+
+# frames given to the render paths at a time
+_BATCH = 4
+
+# consecutive video frames in each run of checked frames
+_RUN = 5
+
+# a way of rendering the overlays onto video frames
+# paths are given the frame times when created, and then batches of frames
+# in time order. elapsed is the time spent on the work the path does in
+# vidlog, for the speedup. paths that can reuse drawing from an earlier frame
+# count the frames where they did in reused
+class RenderPath(object):
+    name = None
+    # how much the max pixel difference and the min PSNR in dB are relaxed
+    # for conversions the path makes that the reference does not
+    conversion_diff = 0
+    conversion_psnr = 0.0
+
+    def __init__(self, cfg, logfile, times):
+        self._cfg = cfg
+        self._logfile = logfile
+        self._times = times
+        self.elapsed = 0.0
+        self.reused = 0
+
+    def close(self):
+        pass
+
+    # return copies of the frames with the overlays
+    def render(self, frames, framenums):
+        return [self.render_frame(frame, self._times[framenum])
+                for frame, framenum in zip(frames, framenums)]
+
+    def render_frame(self, frame, real_time):
+        raise NotImplementedError
+
+    # convert the reference frames the same way the path converts its output
+    # apart from the overlays, so that only the overlays are compared
+    def convert(self, frames):
+        return frames
+
+# the overlays drawn directly onto the frame by VidLog.draw_overlay with
+# cv.addWeighted and cv.putText. this is what the other paths must match
+class ReferencePath(RenderPath):
+    name = "reference"
+
+    def __init__(self, cfg, logfile, times):
+        super().__init__(cfg, logfile, times)
+        self._lb = LogBuffer(logfile, maxlines=cfg.log.lines, filtercfg=cfg.filter)
+
+    def close(self):
+        self._lb.close()
+
+    def render_frame(self, frame, real_time):
+        frame = frame.copy()
+        tstart = time.perf_counter()
+        VidLog.draw_overlay(frame, real_time, self._lb, self._cfg.log, self._cfg.time)
+        self.elapsed += time.perf_counter() - tstart
+        return frame
+
+# the overlays rendered as an alpha track (--overlay-cache) and composited
+# onto the frame with the ffmpeg overlay filter, the same as add_dash. only
+# the area of the track is sent through ffmpeg. the overlay filter blends in
+# yuv420p, so the reference frames are also converted to yuv420p and back.
+# the filter blends the chroma with the alpha at half resolution and rounds
+# the luma differently from a blend in BGR, which gives differences of up to
+# 48 and a PSNR of 36.5 dB on noise frames, so the tolerance is relaxed for
+# that. the time is for drawing the track, which is done once for all
+# exports of a video
+class AlphaTrackPath(RenderPath):
+    name = "alpha-track"
+    conversion_diff = 62
+    conversion_psnr = 10.0
+
+    def __init__(self, cfg, logfile, times):
+        super().__init__(cfg, logfile, times)
+        self._lb = LogBuffer(logfile, maxlines=cfg.log.lines, filtercfg=cfg.filter)
+        self._panels = OverlayPanels(cfg)
+        self._canvas = self._panels.canvas()
+        self._lines = None
+
+    def close(self):
+        self._lb.close()
+
+    def render(self, frames, framenums):
+        tracks = []
+        for framenum in framenums:
+            real_time = self._times[framenum]
+            tstart = time.perf_counter()
+            self._lb.update(real_time)
+            lines = tuple(self._lb)
+            redraw = lines != self._lines
+            self._panels.draw(self._canvas, real_time, lines, redraw)
+            self._lines = lines
+            self.elapsed += time.perf_counter() - tstart
+            if not redraw:
+                self.reused += 1
+            tracks.append(self._canvas.tobytes())
+
+        panels = self._panels
+        with tempfile.NamedTemporaryFile(suffix=".bgra") as trackfile:
+            trackfile.write(b"".join(tracks))
+            trackfile.flush()
+            track = ffmpeg.input(trackfile.name, format="rawvideo", pix_fmt="bgra",
+                                 s=f"{panels.width}x{panels.height}")
+            return self._through_ffmpeg(frames, lambda main: main.overlay(track, x="0", y="0"))
+
+    def convert(self, frames):
+        return self._through_ffmpeg(frames, lambda main: main.filter("format", "yuv420p"))
+
+    # send the area of the track in each frame through an ffmpeg filter, and
+    # return copies of the frames with the filtered area
+    def _through_ffmpeg(self, frames, graph):
+        panels = self._panels
+        area = (slice(panels.y, panels.y + panels.height),
+                slice(panels.x, panels.x + panels.width))
+        height, width = frames[0][area].shape[:2]
+        main = ffmpeg.input("pipe:", format="rawvideo", pix_fmt="bgr24", s=f"{width}x{height}")
+        out, _ = (graph(main)
+                  .output("pipe:", format="rawvideo", pix_fmt="bgr24")
+                  .global_args("-hide_banner", "-loglevel", "error")
+                  .run(input=b"".join(frame[area].tobytes() for frame in frames),
+                       capture_stdout=True))
+        areas = np.frombuffer(out, dtype=np.uint8).reshape(len(frames), height, width, 3)
+        frames = [frame.copy() for frame in frames]
+        for frame, filtered in zip(frames, areas):
+            frame[area] = filtered
+        return frames
+
+# the overlays drawn by renderer processes (--jobs) into frames in a shared
+# memory frame ring, the same as _overlay_parallel. the frames of a batch are
+# copied into the ring slots and rendered at the same time. the time is from
+# sending the batch to the renderers until all of its frames are done, as
+# vidlog decodes straight into the ring slots
+class FrameRingPath(RenderPath):
+    name = "frame-ring"
+    jobs = 2
+
+    def __init__(self, cfg, logfile, times):
+        super().__init__(cfg, logfile, times)
+        self._ring = None
+        self._renderers = []
+        self._work_q = mp.Queue()
+        self._done_q = mp.Queue()
+        self._abort = mp.Event()
+
+    # the ring is created for the size of the first frames
+    def _start(self, shape):
+        self._ring = FrameRing(_BATCH, shape)
+        cfg = self._cfg
+        self._renderers = [mp.Process(target=_render_frames,
+                                      args=(self._ring.name, _BATCH, shape, self._logfile, 0,
+                                            np.asarray(self._times), dict(cfg.log._cfg),
+                                            dict(cfg.time._cfg), dict(cfg.filter._cfg),
+                                            self._work_q, self._done_q, self._abort))
+                           for _ in range(FrameRingPath.jobs)]
+        for renderer in self._renderers:
+            renderer.start()
+
+    def close(self):
+        self._abort.set()
+        for renderer in self._renderers:
+            renderer.join(5)
+            if renderer.is_alive():
+                renderer.terminate()
+                renderer.join()
+        if self._ring:
+            self._ring.close()
+            self._ring.unlink()
+
+    def render(self, frames, framenums):
+        if self._ring is None:
+            self._start(frames[0].shape)
+        for slot, frame in enumerate(frames):
+            self._ring.frame(slot)[:] = frame
+        tstart = time.perf_counter()
+        for slot, framenum in enumerate(framenums):
+            self._work_q.put((slot, slot, framenum))
+        for _ in frames:
+            while True:
+                try:
+                    item = self._done_q.get(timeout=1.0)
+                    break
+                except queue.Empty:
+                    if not all(r.is_alive() for r in self._renderers):
+                        raise RuntimeError("a frame-ring renderer process stopped")
+            if item is None:
+                raise RuntimeError("a frame-ring renderer process stopped")
+        self.elapsed += time.perf_counter() - tstart
+        return [self._ring.frame(slot).copy() for slot in range(len(frames))]
+
+# accelerated render paths that are checked against the reference
+# new paths are added here
+_paths = [AlphaTrackPath, FrameRingPath]
+
+# renders selected frames of synthetic inputs through the reference path
+# and each accelerated path, and compares the results inside the overlay
+# boxes. pixels outside the overlay boxes must not change at all
+class GoldenHarness(object):
+    _patterns = ("noise", "gradient", "black", "white")
+
+    def __init__(self, cfg, size=(3840, 2160), frames=20, max_diff=2, min_psnr=45.0,
+                 min_ssim=0.99):
+        self._cfg = cfg
+        self._width, self._height = size
+        self._frames = frames
+        self._max_diff = max_diff
+        self._min_psnr = min_psnr
+        self._min_ssim = min_ssim
+        self._rects = [("log", cfg.log), ("time", cfg.time)]
+        logging.debug("Created GoldenHarness\n" + str(self))
+
+    def __str__(self):
+        desc = "GoldenHarness:\n"
+        desc += f"frame size: {self._width}x{self._height}\n"
+        desc += f"frames:     {self._frames} per pattern\n"
+        desc += f"tolerance:  diff {self._max_diff}, PSNR {self._min_psnr} dB, SSIM {self._min_ssim}\n"
+        return desc
+
+    # write a synthetic log file, with lines of different lengths including
+    # lines that overflow the log box. lines are only logged in the even
+    # seconds, so the log box does not change during the odd seconds
+    @staticmethod
+    def synthetic_log(filename, start, seconds, rate=100):
+        rng = np.random.default_rng(0)
+        with open(filename, "wt") as logfile:
+            logfile.write("ts message\n")
+            for linenum in range(int(seconds * rate)):
+                if (linenum // rate) % 2:
+                    continue
+                ts = datetime.datetime.fromtimestamp(start + linenum / rate)
+                values = ", ".join(f"'Signal_{n}': {rng.integers(-5000, 5000) / 10}"
+                                   for n in range(rng.integers(1, 12)))
+                logfile.write(f"{ts.strftime('%Y-%m-%d %H:%M:%S.%f')} {{{values}}}\n")
+
+    def synthetic_frame(self, pattern, seed):
+        shape = (self._height, self._width, 3)
+        if pattern == "noise":
+            return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+        if pattern == "gradient":
+            ramp = np.linspace(0, 255, self._width, dtype=np.float32)
+            frame = np.empty(shape, dtype=np.uint8)
+            frame[...] = np.rint(ramp)[np.newaxis, :, np.newaxis]
+            frame[..., 1] = np.rint(np.linspace(0, 255, self._height))[:, np.newaxis]
+            return frame
+        if pattern == "black":
+            return np.zeros(shape, dtype=np.uint8)
+        return np.full(shape, 255, dtype=np.uint8)
+
+    def run(self):
+        start = datetime.datetime(2022, 3, 6, 17, 22, 7).timestamp()
+        seconds = 60
+        workdir = tempfile.mkdtemp(prefix="vidlog-golden-")
+        logfile = os.path.join(workdir, "golden_log.txt")
+        GoldenHarness.synthetic_log(logfile, start, seconds)
+        # runs of consecutive frames spread over the log, starting in even
+        # and odd seconds in turn, so that there are runs where the log box
+        # changes every frame and runs where it does not change
+        runs = max(1, -(-self._frames // _RUN))
+        firsts = 2 * np.floor(np.linspace(0, seconds / 2 - 1, runs))
+        firsts += np.arange(runs) % 2 + 0.213
+        times = (firsts[:, np.newaxis] + np.arange(_RUN) / 30.0).ravel()[:self._frames]
+        times = start + times
+
+        results = []
+        try:
+            for pathclass in _paths:
+                for pattern in GoldenHarness._patterns:
+                    results.append(self.compare(pathclass, pattern, logfile, times))
+        finally:
+            pathlib.Path(logfile).unlink(missing_ok=True)
+            pathlib.Path(workdir).rmdir()
+        return results
+
+    # render all the selected frames through the reference and one path
+    def compare(self, pathclass, pattern, logfile, times):
+        ref = ReferencePath(self._cfg, logfile, times)
+        path = pathclass(self._cfg, logfile, times)
+        result = dict(path=pathclass.name, pattern=pattern, ref_time=0.0, path_time=0.0,
+                      max_diff=0, psnr=_PSNR_IDENTICAL, ssim=1.0, outside=0)
+        try:
+            for first in range(0, len(times), _BATCH):
+                framenums = range(first, min(first + _BATCH, len(times)))
+                frames = [self.synthetic_frame(pattern, framenum) for framenum in framenums]
+                expected = path.convert(ref.render(frames, framenums))
+                actual = path.render(frames, framenums)
+                for exp, act in zip(expected, actual):
+                    self.measure(result, exp, act)
+        finally:
+            ref.close()
+            path.close()
+        result["ref_time"] = ref.elapsed
+        result["path_time"] = path.elapsed
+        result["reused"] = path.reused
+        result["speedup"] = ref.elapsed / max(path.elapsed, 1e-9)
+        result["passed"] = (result["max_diff"] <= self._max_diff + pathclass.conversion_diff and
+                            result["psnr"] >= self._min_psnr - pathclass.conversion_psnr and
+                            result["ssim"] >= self._min_ssim and
+                            result["outside"] == 0)
+        return result
+
+    # keep the worst differences seen inside the overlay boxes, and count
+    # changed pixels outside of them
+    def measure(self, result, expected, actual):
+        inside = np.zeros(expected.shape[:2], dtype=bool)
+        for _, rect in self._rects:
+            box = (slice(rect.y, rect.y + rect.height), slice(rect.x, rect.x + rect.width))
+            inside[box] = True
+            exp = expected[box]
+            act = actual[box]
+            diff = np.abs(exp.astype(np.int16) - act).max()
+            result["max_diff"] = max(result["max_diff"], int(diff))
+            result["psnr"] = min(result["psnr"], cv.PSNR(exp, act))
+            result["ssim"] = min(result["ssim"], GoldenHarness.ssim(exp, act))
+        changed = np.any(expected != actual, axis=2) & ~inside
+        result["outside"] += int(np.count_nonzero(changed))
+
+    # structural similarity of two BGR images, on the luma with the usual
+    # 11x11 gaussian window
+    @staticmethod
+    def ssim(img1, img2):
+        c1 = (0.01 * 255) ** 2
+        c2 = (0.03 * 255) ** 2
+        x = cv.cvtColor(img1, cv.COLOR_BGR2GRAY).astype(np.float64)
+        y = cv.cvtColor(img2, cv.COLOR_BGR2GRAY).astype(np.float64)
+        blur = lambda img: cv.GaussianBlur(img, (11, 11), 1.5)
+        mux = blur(x)
+        muy = blur(y)
+        sxx = blur(x * x) - mux * mux
+        syy = blur(y * y) - muy * muy
+        sxy = blur(x * y) - mux * muy
+        ssim_map = (((2 * mux * muy + c1) * (2 * sxy + c2)) /
+                    ((mux * mux + muy * muy + c1) * (sxx + syy + c2)))
+        return float(ssim_map.mean())
+
+def golden_cli():
+    parser = argparse.ArgumentParser(description="Check accelerated render paths against the reference")
+    parser.add_argument('-v', "--verbose", action="store_true",
+                        help="turn on extra output")
+    parser.add_argument("--config-name", type=str, default="vidlog.ini",
+                        help="specify config file name (default: vidlog.ini)")
+    parser.add_argument("--size", default="3840x2160",
+                        help="synthetic frame size (default: 3840x2160)")
+    parser.add_argument("--frames", type=int, default=20,
+                        help="frames to check for each pattern (default: 20)")
+    parser.add_argument("--max-diff", type=int, default=2,
+                        help="max pixel difference in the overlay boxes (default: 2)")
+    parser.add_argument("--min-psnr", type=float, default=45.0,
+                        help="min PSNR in dB in the overlay boxes (default: 45)")
+    parser.add_argument("--min-ssim", type=float, default=0.99,
+                        help="min SSIM in the overlay boxes (default: 0.99)")
+
+    args = parser.parse_args()
+
+    loglevel = logging.DEBUG if args.verbose else logging.WARNING
+    logging.basicConfig(level=loglevel, format="%(levelname)s:%(message)s")
+
+    try:
+        width, height = (int(n) for n in args.size.lower().split("x"))
+    except ValueError:
+        parser.error(f"invalid size '{args.size}'")
+
+    cfgfile = args.config_name if os.path.isfile(args.config_name) else None
+    harness = GoldenHarness(Config(cfgfile), size=(width, height), frames=args.frames,
+                            max_diff=args.max_diff, min_psnr=args.min_psnr,
+                            min_ssim=args.min_ssim)
+    results = harness.run()
+
+    print(f"{'path':12} {'pattern':9} {'max diff':>8} {'PSNR':>7} {'SSIM':>7} "
+          f"{'outside':>8} {'reused':>7} {'speedup':>8}  result")
+    for result in results:
+        print(f"{result['path']:12} {result['pattern']:9} {result['max_diff']:8} "
+              f"{result['psnr']:7.1f} {result['ssim']:7.4f} {result['outside']:8} "
+              f"{result['reused']:7} {result['speedup']:7.2f}x  {'ok' if result['passed'] else 'FAILED'}")
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
+
+if __name__ == "__main__":
+    golden_cli()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+# SPDX-License-Identifier: MIT
+#
+# Copyright 2022 Joseph Kroesche
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import argparse
+import tempfile
+import os
+import sys
+import time
+import configparser
+import pathlib
+import subprocess
+import logging
+import cv2 as cv
+import ffmpeg
+from .vidlog import VidProps, PerfConfig, profile_path, vidlog_command
+
+__all__ = ["Tuner", "tune_cli"]
+
+# PSNR reported by opencv for identical frames
+_PSNR_IDENTICAL = 361.0
+
+# renders a sample window of a video with different performance settings
+# and finds the fastest settings that still meet the quality floor.
+# the settings are tuned one at a time, in order, keeping the best value
+# found for each setting before trying the next one. each run is a separate
+# vidlog process so that its speed and peak memory can be measured. the runs
+# use a copy of only the sample window, so that the time to read the whole
+# input video is not counted
+class Tuner(object):
+    def __init__(self, vidfile, logfile, dashfile, start=0, sample=10, min_psnr=40.0,
+                 cfgfile=None):
+        self._vidfile = vidfile
+        self._logfile = logfile
+        self._dashfile = dashfile
+        self._start = start
+        self._sample = sample
+        self._min_psnr = min_psnr
+        self._cfgfile = cfgfile
+        self._frames = int(sample * VidProps(vidfile).framerate)
+        self._workdir = tempfile.mkdtemp(prefix="vidlog-tune-")
+        self._sampfile = None
+        self._reference = None
+        self.results = []
+        logging.debug("Created Tuner\n" + str(self))
+
+    def __str__(self):
+        desc = "Tuner:\n"
+        desc += f"input:    {self._vidfile}\n"
+        desc += f"sample:   {self._sample} secs at {self._start} secs, {self._frames} frames\n"
+        desc += f"min PSNR: {self._min_psnr} dB\n"
+        return desc
+
+    # candidate values for each setting, in the order they are tuned
+    @staticmethod
+    def candidates():
+        cpus = os.cpu_count()
+        jobs = sorted({1, 2, 4, max(1, cpus // 2), max(1, cpus - 1)})
+        return [
+            ("jobs", [str(n) for n in jobs]),
+            ("slots", ["1", "2", "4"]),
+            ("backend", ["any", "ffmpeg", "ffmpeg-hw"]),
+            ("preset", ["", "fast", "faster", "veryfast", "superfast"]),
+            ("threads", [str(n) for n in sorted({0, max(1, cpus // 2), cpus})]),
+        ]
+
+    def tune(self):
+        self.cut_sample()
+        best = dict(PerfConfig._default)
+        # the first run uses the default settings and is the quality reference
+        best_fps = self.measure(best)
+        if best_fps is None:
+            raise RuntimeError("the sample could not be rendered with the default settings")
+
+        for key, values in Tuner.candidates():
+            for value in values:
+                if value == best[key]:
+                    continue
+                settings = dict(best, **{key: value})
+                fps = self.measure(settings)
+                if fps is not None and fps > best_fps:
+                    best = settings
+                    best_fps = fps
+            logging.info(f"best {key}: {best[key]!r}")
+        return best, best_fps
+
+    # copy the sample window of the input video to its own file, without
+    # encoding it again. the copy keeps the stream tags that vidlog needs
+    def cut_sample(self):
+        self._sampfile = os.path.join(self._workdir, "sample.mov")
+        (ffmpeg
+         .input(self._vidfile, ss=self._start, t=self._sample)
+         .output(self._sampfile, c="copy")
+         .global_args("-hide_banner", "-loglevel", "error")
+         .overwrite_output()
+         .run())
+
+    # render the sample with some settings. returns the frames per second,
+    # or None if the run failed or did not meet the quality floor
+    def measure(self, settings):
+        run = len(self.results)
+        profile = os.path.join(self._workdir, f"run{run}.ini")
+        output = os.path.join(self._workdir, f"run{run}.mp4")
+        cfg = configparser.ConfigParser(interpolation=None)
+        cfg["Performance"] = settings
+        with open(profile, "wt") as pfile:
+            cfg.write(pfile)
+
+        # use the file time, extracting the GPS data would be timed with every run
+        args = vidlog_command() + ["--quiet", "--bad-gps",
+                "-i", self._sampfile, "-l", self._logfile, "-d", self._dashfile,
+                "-o", output, "-t", str(self._sample), "--profile", profile]
+        if self._cfgfile:
+            args += ["--config-name", self._cfgfile]
+        logging.info(f"run {run}: {Tuner.describe(settings)}")
+        start = time.monotonic()
+        proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # ru_maxrss from wait4 is the peak memory of the largest single process
+        # of the run (vidlog, a renderer or ffmpeg), not the total of them
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.monotonic() - start
+        if os.WIFEXITED(status):
+            proc.returncode = os.WEXITSTATUS(status)
+        else:
+            proc.returncode = -os.WTERMSIG(status)
+
+        result = dict(settings=settings, fps=None, maxrss=Tuner.maxrss_mb(usage), psnr=None)
+        self.results.append(result)
+        if proc.returncode != 0:
+            logging.info(f"run {run} failed with exit code {proc.returncode}")
+            return None
+        if self._reference is None:
+            self._reference = output
+            result["psnr"] = _PSNR_IDENTICAL
+        else:
+            result["psnr"] = self.psnr(output)
+            pathlib.Path(output).unlink(missing_ok=True)
+        result["fps"] = self._frames / elapsed
+        logging.info(f"run {run}: {result['fps']:.1f} fps, largest process "
+                     f"{result['maxrss']:.0f} MB, PSNR {result['psnr']:.1f} dB")
+        if result["psnr"] < self._min_psnr:
+            logging.info(f"run {run} is below the quality floor")
+            return None
+        return result["fps"]
+
+    # lowest PSNR of evenly spaced frames of an output against the reference
+    def psnr(self, output, samples=10):
+        ref = cv.VideoCapture(self._reference)
+        cap = cv.VideoCapture(output)
+        lowest = _PSNR_IDENTICAL
+        step = max(1, self._frames // samples)
+        framenum = 0
+        while True:
+            ret1, refframe = ref.read()
+            ret2, frame = cap.read()
+            if not ret1 or not ret2:
+                break
+            if framenum % step == 0:
+                if frame.shape != refframe.shape:
+                    lowest = 0.0
+                    break
+                lowest = min(lowest, cv.PSNR(refframe, frame))
+            framenum += 1
+        ref.release()
+        cap.release()
+        return lowest
+
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    @staticmethod
+    def maxrss_mb(usage):
+        if sys.platform == "darwin":
+            return usage.ru_maxrss / (1024 * 1024)
+        return usage.ru_maxrss / 1024
+
+    @staticmethod
+    def describe(settings):
+        return " ".join(f"{key}={value!r}" for key, value in settings.items())
+
+    def cleanup(self):
+        for path in pathlib.Path(self._workdir).iterdir():
+            path.unlink()
+        pathlib.Path(self._workdir).rmdir()
+
+def tune_cli():
+    parser = argparse.ArgumentParser(description="Find the fastest vidlog settings for this machine")
+    parser.add_argument('-v', "--verbose", action="store_true",
+                        help="turn on extra output")
+    parser.add_argument('-q', "--quiet", action="store_true",
+                        help="silence all output")
+    parser.add_argument('-i', "--input", required=True, help="input video file")
+    parser.add_argument('-l', "--logfile", required=True, help="input log text file")
+    parser.add_argument('-d', "--dash", required=True, help="input dash instruments video cap")
+    parser.add_argument('-t', "--sample", type=int, default=10,
+                        help="length of the sample window in seconds (default: 10)")
+    parser.add_argument('-ss', "--start", type=int, default=0,
+                        help="start of the sample window in seconds")
+    parser.add_argument("--min-psnr", type=float, default=40.0,
+                        help="quality floor, PSNR in dB against the default settings (default: 40)")
+    parser.add_argument("--config-name", type=str, default="vidlog.ini",
+                        help="specify config file name (default: vidlog.ini)")
+    parser.add_argument("--profile", type=str, default=str(profile_path()),
+                        help=f"profile file to write (default: {profile_path()})")
+
+    args = parser.parse_args()
+
+    if args.quiet:
+        loglevel = logging.WARNING
+    elif args.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+    logging.basicConfig(level=loglevel, format="%(levelname)s:%(message)s")
+
+    cfgfile = os.path.abspath(args.config_name) if os.path.isfile(args.config_name) else None
+    tuner = Tuner(args.input, args.logfile, args.dash, start=args.start,
+                  sample=args.sample, min_psnr=args.min_psnr, cfgfile=cfgfile)
+    try:
+        best, fps = tuner.tune()
+    finally:
+        tuner.cleanup()
+
+    # save the best settings, and the measurement for reference
+    maxrss = max(r["maxrss"] for r in tuner.results if r["settings"] == best)
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg["Performance"] = best
+    cfg["TuneResult"] = {
+        "date": datetime.datetime.now().isoformat(sep=' ', timespec="seconds"),
+        "input": os.path.abspath(args.input),
+        "fps": f"{fps:.2f}",
+        "maxrss": f"{maxrss:.0f} MB (largest process)",
+        "runs": str(len(tuner.results))
+        }
+    pathlib.Path(args.profile).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.profile, "wt") as pfile:
+        cfg.write(pfile)
+    print(f"Best settings: {Tuner.describe(best)}")
+    print(f"{fps:.1f} fps, peak memory of the largest process {maxrss:.0f} MB")
+    print(f"Saved profile {args.profile}")
+
+if __name__ == "__main__":
+    tune_cli()
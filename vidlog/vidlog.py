@@ -36,16 +36,55 @@ import xml.etree.ElementTree as ET
 import subprocess
 import pathlib
 import logging
+import multiprocessing as mp
+import re
+import csv
+import math
+import numpy as np
+import collections
+import bisect
+import queue
+import hashlib
+import socket
+from .framering import FrameRing
 
 _verbose = False
 _quiet = False
 
+# change this when the overlay track rendering changes, so that old cached
+# overlay tracks are not used
+_TRACK_VERSION = 1
+
+# GPS samples further apart than this many seconds are not used for drift
+# correction
+_GPS_MAX_GAP = 1.5
+
+# the most the camera clock is expected to drift from GPS time, as a fraction
+# of the video time (0.001 is 3.6 seconds an hour)
+_GPS_MAX_DRIFT = 0.001
+
+# how often in seconds the overlay processes check that the other processes
+# are still running, while waiting for frames
+_WORKER_POLL = 1.0
+
+# location of the performance profile for this machine
+def profile_path():
+    return pathlib.Path.home() / ".config" / "vidlog" / f"{socket.gethostname()}.ini"
+
+# command line to run vidlog in a new process. the cli entry point is called
+# directly, running the package module with -m would import it twice
+def vidlog_command():
+    return [sys.executable, "-c",
+            "import sys; sys.argv[0] = 'vidlog'; from vidlog.vidlog import cli; cli()"]
+
 class Config(object):
-    def __init__(self, cfgfile=None):
+    # a profile is a config file read after the main config file, so its
+    # settings replace the main config file settings
+    def __init__(self, cfgfile=None, profile=None):
         self._cfgfile = cfgfile
-        self._cfg = configparser.ConfigParser()
-        if cfgfile:
-            self._cfg.read(cfgfile)
+        # no interpolation, so that regular expressions can use '%'
+        self._cfg = configparser.ConfigParser(interpolation=None)
+        self._cfg.read([name for name in (cfgfile, profile) if name])
 
         if self._cfg.has_section('LogOverlay'):
             cfglog = self._cfg['LogOverlay']
@@ -67,10 +106,36 @@ class Config(object):
         else:
             self._time = TimeConfig()
             self.create_section("TimeOverlay", self._time._cfg)
+
+        if self._cfg.has_section('LogFilter'):
+            cfgfilter = self._cfg['LogFilter']
+            self._filter = FilterConfig(config=cfgfilter)
+        else:
+            self._filter = FilterConfig()
+            self.create_section("LogFilter", self._filter._cfg)
+
+        if self._cfg.has_section('Performance'):
+            cfgperf = self._cfg['Performance']
+            self._perf = PerfConfig(config=cfgperf)
+        else:
+            self._perf = PerfConfig()
+            self.create_section("Performance", self._perf._cfg)
+
+        if self._cfg.has_section('EventScan'):
+            cfgevent = self._cfg['EventScan']
+            self._events = EventConfig(config=cfgevent)
+        else:
+            self._events = EventConfig()
+            self.create_section("EventScan", self._events._cfg)
+        # event rules are optional, each one has its own section
+        for section in self._cfg.sections():
+            if section.startswith("Event:"):
+                self._events.add_rule(EventRule(section[6:], self._cfg[section]))
         logging.debug("Config:\n" + str(self))
 
     def __str__(self):
-        return str(self._log) + str(self._dash) + str(self._time)
+        return (str(self._log) + str(self._dash) + str(self._time)
+                + str(self._filter) + str(self._perf) + str(self._events))
 
     def create_section(self, section_name, contents):
         self._cfg.add_section(section_name)
@@ -89,6 +154,18 @@ class Config(object):
     def time(self):
         return self._time
 
+    @property
+    def filter(self):
+        return self._filter
+
+    @property
+    def perf(self):
+        return self._perf
+
+    @property
+    def events(self):
+        return self._events
+
     def save(self, cfgfile):
         self._cfgfile = cfgfile
         with open(cfgfile, "wt") as cfile:
@@ -219,24 +296,358 @@ class TimeConfig(object):
         desc += f"  colors:         fg({self.fgcolor}) bg({self.bgcolor}) alpha({self.alpha})\n"
         return desc
 
+class FilterConfig(object):
+    _default = {
+        "include": "",
+        "exclude": "",
+        "ratelimit": "0",
+        "ratelimits": "",
+        "collapse": "no"
+        }
+
+    def __init__(self, config=None):
+        if config:
+            cfg = config
+        else:
+            cfg = FilterConfig._default
+
+        self._cfg = cfg
+        self.include = cfg['include']
+        self.exclude = cfg['exclude']
+        self.ratelimit = int(cfg['ratelimit'])
+        # per message type rate limits, "type:limit, type:limit"
+        self.ratelimits = {}
+        for item in cfg['ratelimits'].split(","):
+            if item.strip():
+                msgtype, _, limit = item.rpartition(":")
+                self.ratelimits[msgtype.strip()] = int(limit)
+        self.collapse = cfg['collapse'].lower() in ("yes", "true", "on", "1")
+
+    @property
+    def active(self):
+        return bool(self.include or self.exclude or self.ratelimit or self.ratelimits)
+
+    def __str__(self):
+        desc = "FilterConfig:\n"
+        desc += f"  include:        {self.include}\n"
+        desc += f"  exclude:        {self.exclude}\n"
+        desc += f"  rate limit:     {self.ratelimit} {self.ratelimits}\n"
+        desc += f"  collapse:       {self.collapse}\n"
+        return desc
+
+class PerfConfig(object):
+    _backendmap = {
+        "any": (cv.CAP_ANY, False),
+        "ffmpeg": (cv.CAP_FFMPEG, False),
+        "ffmpeg-hw": (cv.CAP_FFMPEG, True)
+        }
+    _default = {
+        "jobs": "1",
+        "slots": "2",
+        "backend": "any",
+        "preset": "",
+        "threads": "0"
+        }
+
+    def __init__(self, config=None):
+        if config:
+            cfg = config
+        else:
+            cfg = PerfConfig._default
+
+        self._cfg = cfg
+        self.jobs = max(1, int(cfg['jobs']))
+        self.slots = max(1, int(cfg['slots']))
+        self.backend = cfg['backend']
+        if self.backend not in PerfConfig._backendmap:
+            raise ValueError(f"unknown video backend '{self.backend}'")
+        self.preset = cfg['preset']
+        self.threads = int(cfg['threads'])
+
+    def __str__(self):
+        desc = "PerfConfig:\n"
+        desc += f"  render jobs:    {self.jobs}\n"
+        desc += f"  slots per job:  {self.slots}\n"
+        desc += f"  video backend:  {self.backend}\n"
+        desc += f"  encoder preset: {self.preset}\n"
+        desc += f"  threads:        {self.threads}\n"
+        return desc
+
+    # open a video capture using the configured backend
+    def capture(self, vidfile):
+        api, hwaccel = PerfConfig._backendmap[self.backend]
+        if hwaccel:
+            params = [cv.CAP_PROP_HW_ACCELERATION, cv.VIDEO_ACCELERATION_ANY]
+            return cv.VideoCapture(vidfile, api, params)
+        return cv.VideoCapture(vidfile, api)
+
+    # ffmpeg output settings for the final encode
+    def encoder_args(self):
+        kwargs = {}
+        if self.preset:
+            kwargs["preset"] = self.preset
+        if self.threads:
+            kwargs["threads"] = self.threads
+        return kwargs
+
+class EventConfig(object):
+    _default = {
+        "padbefore": "5",
+        "padafter": "5",
+        "mergegap": "2"
+        }
+
+    def __init__(self, config=None):
+        if config:
+            cfg = config
+        else:
+            cfg = EventConfig._default
+
+        self._cfg = cfg
+        self.padbefore = float(cfg['padbefore'])
+        self.padafter = float(cfg['padafter'])
+        self.mergegap = float(cfg['mergegap'])
+        self.rules = []
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+
+    def __str__(self):
+        desc = "EventConfig:\n"
+        desc += f"  padding:        {self.padbefore} before, {self.padafter} after\n"
+        desc += f"  merge gap:      {self.mergegap}\n"
+        for rule in self.rules:
+            desc += str(rule)
+        return desc
+
+# a rule for finding interesting events in the log file
+# a rule can match the log line text with a regular expression, or it can
+# check the value of a named field in the log line. field values can be
+# compared against thresholds, or any change of the value can be an event
+class EventRule(object):
+    def __init__(self, name, config):
+        self.name = name
+        match = config.get('match')
+        self.match = re.compile(match) if match else None
+        self.field = config.get('field')
+        above = config.get('above')
+        below = config.get('below')
+        self.above = float(above) if above else None
+        self.below = float(below) if below else None
+        self.change = config.get('change', "no").lower() in ("yes", "true", "on", "1")
+        if not self.match and not self.field:
+            raise ValueError(f"event rule '{name}' needs a 'match' or a 'field'")
+        if self.field and self.above is None and self.below is None and not self.change:
+            raise ValueError(f"event rule '{name}' needs 'above', 'below' or 'change' for field")
+        self._fieldkey = f"'{self.field}'" if self.field else None
+        self._last = None
+
+    def __str__(self):
+        desc = f"  rule {self.name}:"
+        if self.match:
+            desc += f" match({self.match.pattern})"
+        if self.field:
+            desc += f" field({self.field})"
+        if self.above is not None:
+            desc += f" above({self.above})"
+        if self.below is not None:
+            desc += f" below({self.below})"
+        if self.change:
+            desc += " change"
+        return desc + "\n"
+
+    # check one log line against the rule
+    # fields holds the parsed field dict for the line, shared by all the rules
+    # so that a line is only parsed once and only when some rule needs it
+    def check(self, line, fields):
+        if self.match and not self.match.search(line):
+            return False
+        if not self.field:
+            return True
+        if self._fieldkey not in line:
+            return False
+        if "parsed" not in fields:
+            try:
+                fields["parsed"] = ast.literal_eval(line[27:])
+            except (ValueError, SyntaxError):
+                fields["parsed"] = {}
+        if not isinstance(fields["parsed"], dict) or self.field not in fields["parsed"]:
+            return False
+        value = fields["parsed"][self.field]
+        hit = False
+        if self.change:
+            hit = self._last is not None and value != self._last
+            self._last = value
+        try:
+            if self.above is not None and float(value) > self.above:
+                hit = True
+            if self.below is not None and float(value) < self.below:
+                hit = True
+        except (TypeError, ValueError):
+            pass
+        return hit
+
+# a time window in the log containing one or more events
+# offset is where in the log file to start reading to render the window
+class EventWindow(object):
+    def __init__(self, start, end, offset=0):
+        self.start = start
+        self.end = end
+        self.offset = offset
+        self.hits = 0
+        self.rules = []
+
+    def add(self, end, rules):
+        self.end = max(self.end, end)
+        self.hits += 1
+        for rule in rules:
+            if rule not in self.rules:
+                self.rules.append(rule)
+
+    def __str__(self):
+        start = datetime.datetime.fromtimestamp(self.start).isoformat(sep=' ')
+        return f"{start} +{self.end - self.start:.1f}s {self.hits} hits ({', '.join(self.rules)})"
+
+# scans a log file for events according to the event rules
+# the log is read once, and the events are merged into padded time windows
+# as they are found. the file offset and time of every Nth line that would be
+# shown in the log display are recorded, so each window can start reading the
+# log shortly before it instead of from the start of the file
+class EventScanner(object):
+    _interval = 1000
+
+    def __init__(self, filename, cfg, lines=10, filtercfg=None):
+        self._filename = filename
+        self._cfg = cfg
+        self._fmt = "%Y-%m-%d %H:%M:%S.%f"
+        self._interval = max(EventScanner._interval, lines)
+        self._filter = None
+        if filtercfg and filtercfg.active:
+            self._filter = LogFilter(filtercfg)
+
+    def scan(self):
+        cfg = self._cfg
+        if not cfg.rules:
+            raise RuntimeError("no event rules found in the configuration")
+        logging.info(f"scanning {self._filename} for events")
+        windows = []
+        times = []
+        offsets = []
+        shown = 0
+        offset = 0
+        # binary mode because text files can not tell the offset while
+        # iterating over lines
+        with open(self._filename, "rb") as logfile:
+            for line in logfile:
+                lineoffset = offset
+                offset += len(line)
+                line = line.decode(errors="replace").strip()
+                if not line or line[0:2] == "ts":
+                    continue
+                if not self._filter or self._filter.accept(line):
+                    if shown % self._interval == 0:
+                        try:
+                            times.append(datetime.datetime.strptime(line[:26], self._fmt).timestamp())
+                            offsets.append(lineoffset)
+                        except ValueError:
+                            pass
+                    shown += 1
+                # every rule sees every line so that rules tracking changes
+                # always know the previous value
+                fields = {}
+                hits = [rule.name for rule in cfg.rules if rule.check(line, fields)]
+                if not hits:
+                    continue
+                # only lines with an event need the timestamp
+                try:
+                    ts = datetime.datetime.strptime(line[:26], self._fmt).timestamp()
+                except ValueError:
+                    logging.warning(f"skipping event with bad timestamp: {line}")
+                    continue
+                start = ts - cfg.padbefore
+                end = ts + cfg.padafter
+                if not windows or start > windows[-1].end + cfg.mergegap:
+                    # the window is rendered from a whole second of video, so
+                    # up to a second before its start. step back one more
+                    # recorded line so the log display is full by then
+                    pos = bisect.bisect_right(times, start - 1.0) - 2
+                    windows.append(EventWindow(start, end, offsets[pos] if pos >= 0 else 0))
+                windows[-1].add(end, hits)
+        logging.info(f"found {len(windows)} event windows")
+        for window in windows:
+            logging.debug(f"event window: {window}")
+        return windows
+
+# decides which log lines are shown in the log display buffer
+# lines are checked as they are read from the log file, before the
+# timestamp is parsed, so dropped lines cost as little as possible.
+# include and exclude are regular expressions matched against the line.
+# rate limits are the max number of lines per second for each message type,
+# where the message type is the first key of the logged dict. the seconds
+# are compared as text from the line timestamp
+class LogFilter(object):
+    _typere = re.compile(r"\{'([^']*)'")
+
+    def __init__(self, cfg):
+        self._include = re.compile(cfg.include) if cfg.include else None
+        self._exclude = re.compile(cfg.exclude) if cfg.exclude else None
+        self._ratelimit = cfg.ratelimit
+        self._ratelimits = cfg.ratelimits
+        self._ratecheck = bool(cfg.ratelimit or cfg.ratelimits)
+        self._counts = {}
+
+    def accept(self, line):
+        if self._include and not self._include.search(line):
+            return False
+        if self._exclude and self._exclude.search(line):
+            return False
+        if self._ratecheck:
+            match = LogFilter._typere.search(line, 26)
+            msgtype = match.group(1) if match else ""
+            limit = self._ratelimits.get(msgtype, self._ratelimit)
+            if limit:
+                second = line[:19]
+                count = self._counts.get(msgtype)
+                if count and count[0] == second:
+                    if count[1] >= limit:
+                        return False
+                    count[1] += 1
+                else:
+                    self._counts[msgtype] = [second, 1]
+        return True
+
 # maintains a list of text lines in the log display buffer
 # based on log file timestamps
 # can be iterated to get the present set of lines
 class LogBuffer(object):
-    def __init__(self, filename, maxlines=10):
+    def __init__(self, filename, maxlines=10, filtercfg=None, offset=0):
         self._fmt = "%Y-%m-%d %H:%M:%S.%f"
         self._max = maxlines
+        self._filter = None
+        self._collapse = False
+        if filtercfg:
+            self._filter = LogFilter(filtercfg) if filtercfg.active else None
+            self._collapse = filtercfg.collapse
         self._file = open(filename, "rt")
+        if offset:
+            # start part way into the log, offset must be the start of a line
+            self._file.seek(offset)
         self._nextline = self._file.readline().strip()
         if self._nextline[0:2] == "ts":
             logging.debug("stripping header line from log file")
             self._nextline = self._file.readline().strip()
+        if self._nextline and self._filter and not self._filter.accept(self._nextline):
+            self._nextline = self._readline()
+        if not self._nextline:
+            raise RuntimeError(f"no log lines found in {filename}")
         self._nextts = datetime.datetime.strptime(self._nextline[:26], self._fmt).timestamp()
         # TODO fix seek to first valid line
         # at the moment we lose first line of data
         # the problem is the header line removal above
         #self._file.seek(0)
-        self._buf = []
+        self._buf = collections.deque(maxlen=maxlines)
+        self._lastmsg = None
+        self._repeats = 0
         logging.debug("Created LogBuffer\n" + str(self))
 
     def __str__(self):
@@ -256,8 +667,8 @@ class LogBuffer(object):
     def update(self, timestamp):
         if self._nextline:
             while timestamp >= self._nextts:
-                self._buf.append(self._nextline)
-                self._nextline = self._file.readline().strip()
+                self._add(self._nextline)
+                self._nextline = self._readline()
                 if self._nextline:
                     self._nextts = datetime.datetime.strptime(self._nextline[:26], self._fmt).timestamp()
                 else:
@@ -265,8 +676,26 @@ class LogBuffer(object):
                     self._buf.append("---end of log---")
                     logging.debug("end of text log")
                     break
-            while len(self._buf) > self._max:
-                self._buf.pop(0)
+
+    # read the next line from the log file that passes the filter
+    def _readline(self):
+        line = self._file.readline().strip()
+        if self._filter:
+            while line and not self._filter.accept(line):
+                line = self._file.readline().strip()
+        return line
+
+    # add a line to the buffer. when collapsing repeats, a line with the same
+    # message as the previous line replaces it and shows the repeat count
+    def _add(self, line):
+        msg = line[26:]
+        if self._collapse and self._buf and msg == self._lastmsg:
+            self._repeats += 1
+            self._buf[-1] = f"{line} (x{self._repeats})"
+        else:
+            self._lastmsg = msg
+            self._repeats = 1
+            self._buf.append(line)
 
     def close(self):
         self._file.close()
@@ -279,15 +708,347 @@ class LogBuffer(object):
     def __iter__(self):
         return iter(self._buf)
 
+# describes one additional output rendition of the final video
+# spec string is the output file name followed by optional comma separated
+# settings, for example: "reduced.mp4,size=1280x720,bitrate=1000k,codec=libx264"
+# any setting that is not given is left to ffmpeg defaults
+class OutputSpec(object):
+    _keys = ("size", "bitrate", "codec")
+
+    def __init__(self, spec):
+        parts = [part.strip() for part in spec.split(",")]
+        if not parts[0]:
+            raise ValueError(f"output spec '{spec}' does not have a file name")
+        self.filename = parts[0]
+        self.width = None
+        self.height = None
+        self.bitrate = None
+        self.codec = None
+        for part in parts[1:]:
+            key, sep, value = part.partition("=")
+            key = key.strip().lower()
+            value = value.strip()
+            if not sep or key not in OutputSpec._keys or not value:
+                raise ValueError(f"invalid setting '{part}' in output spec '{spec}'")
+            if key == "size":
+                try:
+                    w, h = value.lower().split("x")
+                    self.width = int(w)
+                    self.height = int(h)
+                except ValueError:
+                    raise ValueError(f"invalid size '{value}' in output spec '{spec}'")
+            elif key == "bitrate":
+                self.bitrate = value
+            elif key == "codec":
+                self.codec = value
+
+    def __str__(self):
+        desc = f"{self.filename}"
+        if self.width is not None:
+            desc += f" size({self.width}x{self.height})"
+        if self.bitrate:
+            desc += f" bitrate({self.bitrate})"
+        if self.codec:
+            desc += f" codec({self.codec})"
+        return desc
+
+    # apply the scaling for this rendition to a video stream and create
+    # the ffmpeg output node
+    def output(self, vstream, astream):
+        if self.width is not None:
+            vstream = vstream.filter("scale", self.width, self.height)
+        kwargs = {}
+        if self.bitrate:
+            kwargs["video_bitrate"] = self.bitrate
+        if self.codec:
+            kwargs["vcodec"] = self.codec
+        return ffmpeg.output(vstream, astream, self.filename, **kwargs)
+
+# lookup table from video frame number to wall clock time
+# the table is built once from the presentation timestamps of all the video
+# frames. if the GPS time track of the video is available, the drift between
+# the camera clock and GPS time is corrected with a piecewise linear fit of
+# the GPS times, using one knot per segment (in seconds) of video
+class Timeline(object):
+    def __init__(self, vidfile, timestamp, gps_track=None, segment=60.0):
+        logging.info("start building frame timeline")
+        probe = ffmpeg.probe(vidfile, select_streams="v:0", show_entries="packet=pts_time")
+        pts = [float(packet['pts_time']) for packet in probe.get('packets', [])
+               if packet.get('pts_time', "N/A") != "N/A"]
+        if not pts:
+            raise RuntimeError(f"could not find frame timestamps in file {vidfile}")
+        # packets are in decode order, frames are displayed in pts order
+        pts = np.sort(np.array(pts))
+        self._pts = pts - pts[0]
+        self._segment = segment
+
+        fit = None
+        if gps_track is not None and len(gps_track) > 1:
+            fit = Timeline._drift_fit(np.asarray(gps_track), self._pts[-1], segment)
+        if fit:
+            knots, offsets = fit
+            self._wallclock = self._pts + np.interp(self._pts, knots, offsets)
+            self._drift = offsets[-1] - offsets[0]
+        else:
+            self._wallclock = self._pts + timestamp
+            self._drift = 0.0
+        logging.debug("Created Timeline\n" + str(self))
+        logging.info("finished building frame timeline")
+
+    def __str__(self):
+        desc = "Timeline:\n"
+        desc += f"frames:   {len(self._pts)}\n"
+        desc += f"duration: {self._pts[-1]:.3f} secs\n"
+        desc += f"start:    {datetime.datetime.fromtimestamp(self._wallclock[0]).isoformat(sep=' ')}\n"
+        desc += f"drift:    {self._drift:.3f} secs\n"
+        return desc
+
+    # fit the offset between GPS time and camera time
+    # the GPS data does not have the camera time of each sample, so the
+    # samples are assumed to be spread evenly over the video by the camera
+    # clock. that is only true if there is a sample for the whole video, so
+    # if samples are missing returns None and the drift is not corrected.
+    # the offset for each sample is averaged over each segment to make
+    # the knots of the piecewise linear fit
+    @staticmethod
+    def _drift_fit(track, duration, segment):
+        vidtime = np.arange(len(track)) * (duration / len(track))
+        offsets = track - vidtime
+        # discard samples from before the GPS had a fix
+        good = np.abs(offsets - np.median(offsets)) < 5.0 + duration * _GPS_MAX_DRIFT
+        vidtime = vidtime[good]
+        offsets = offsets[good]
+        # a dropout shows as a gap between samples. samples missing at the
+        # start or end (such as a late fix) make the GPS time covered by the
+        # samples shorter than the video time they are spread over, by more
+        # than the clock can drift
+        gpstime = track[good]
+        gap = np.max(np.diff(gpstime), initial=0.0)
+        span = vidtime[-1] - vidtime[0]
+        missing = abs((gpstime[-1] - gpstime[0]) - span)
+        if gap > _GPS_MAX_GAP or missing > _GPS_MAX_GAP + span * _GPS_MAX_DRIFT:
+            logging.warning(f"GPS samples are missing (gap {gap:.1f} secs, "
+                            f"{missing:.1f} secs overall), not correcting clock drift")
+            return None
+        bins = (vidtime // segment).astype(int)
+        counts = np.bincount(bins)
+        valid = counts > 0
+        knots = np.bincount(bins, weights=vidtime)[valid] / counts[valid]
+        offsets = np.bincount(bins, weights=offsets)[valid] / counts[valid]
+        return knots, offsets
+
+    def __len__(self):
+        return len(self._pts)
+
+    # presentation time of each frame in seconds from the start of the video
+    @property
+    def pts(self):
+        return self._pts
+
+    # wall clock timestamp of each frame
+    @property
+    def wallclock(self):
+        return self._wallclock
+
+    # number of the first frame at or after a video offset in seconds
+    def frame_at(self, seconds):
+        return int(np.searchsorted(self._pts, seconds - 0.0005))
+
+    # video offset in seconds of a wall clock timestamp
+    def offset_of(self, timestamp):
+        return float(np.interp(timestamp, self._wallclock, self._pts))
+
+# renders the log and time code overlay boxes with alpha, without the
+# video pixels. the boxes are drawn into a BGRA canvas covering only the
+# area of the frame that contains the boxes
+class OverlayPanels(object):
+    def __init__(self, cfg):
+        self._cfg = cfg
+        lcfg = cfg.log
+        tcfg = cfg.time
+        # area covered by the overlay boxes, the size must be even for encoding
+        self.x = min(lcfg.x, tcfg.x)
+        self.y = min(lcfg.y, tcfg.y)
+        self.width = max(lcfg.x + lcfg.width, tcfg.x + tcfg.width) - self.x
+        self.height = max(lcfg.y + lcfg.height, tcfg.y + tcfg.height) - self.y
+        self.width += self.width % 2
+        self.height += self.height % 2
+
+    def canvas(self):
+        return np.zeros((self.height, self.width, 4), dtype=np.uint8)
+
+    # draw the time code box and, if redraw is set, the log box into the
+    # canvas. the time code box is drawn first and the log box is
+    # composited over it, the same as the order they are drawn on the video
+    def draw(self, canvas, real_time, lines, redraw=True):
+        lcfg = self._cfg.log
+        tcfg = self._cfg.time
+        redraw = redraw or self._overlaps()
+        lx = lcfg.x - self.x
+        ly = lcfg.y - self.y
+        # the old log box must be cleared, so the new box is not composited
+        # over it
+        if redraw:
+            canvas[ly:ly+lcfg.height, lx:lx+lcfg.width] = 0
+        tctext = datetime.datetime.fromtimestamp(real_time).isoformat(sep=' ')
+        panel = OverlayPanels.render_panel(tcfg, [tctext], 0)
+        tx = tcfg.x - self.x
+        ty = tcfg.y - self.y
+        canvas[ty:ty+tcfg.height, tx:tx+tcfg.width] = panel
+        if redraw:
+            panel = OverlayPanels.render_panel(lcfg, lines, lcfg.lineheight)
+            region = canvas[ly:ly+lcfg.height, lx:lx+lcfg.width]
+            region[:] = OverlayPanels._over(panel, region)
+
+    def _overlaps(self):
+        lcfg = self._cfg.log
+        tcfg = self._cfg.time
+        return (lcfg.x < tcfg.x + tcfg.width and tcfg.x < lcfg.x + lcfg.width and
+                lcfg.y < tcfg.y + tcfg.height and tcfg.y < lcfg.y + lcfg.height)
+
+    # render an overlay box with text as BGRA with straight alpha
+    # this gives the same result when composited onto a frame as blending
+    # the box background into the frame and then drawing antialiased text:
+    # text coverage m, box alpha A gives alpha = A(1-m) + m and
+    # color = (A(1-m) bg + m fg) / alpha
+    @staticmethod
+    def render_panel(cfg, lines, lineheight):
+        mask = np.zeros((cfg.height, cfg.width), dtype=np.uint8)
+        for linenum, text in enumerate(lines):
+            cv.putText(mask, text,
+                       (cfg.padx, cfg.pady + (linenum * lineheight)),
+                       cfg.font, cfg.fontscale, 255, 1, cv.LINE_AA)
+        cover = mask.astype(np.float32)[..., np.newaxis] / 255.0
+        alpha = cfg.alpha * (1.0 - cover) + cover
+        color = (cfg.alpha * (1.0 - cover) * np.array(cfg.bgcolor, dtype=np.float32)
+                 + cover * np.array(cfg.fgcolor, dtype=np.float32)) / alpha
+        panel = np.concatenate((color, alpha * 255.0), axis=2)
+        return np.rint(panel).astype(np.uint8)
+
+    # composite straight alpha BGRA src over dst
+    @staticmethod
+    def _over(src, dst):
+        sa = src[..., 3:].astype(np.float32) / 255.0
+        da = dst[..., 3:].astype(np.float32) / 255.0
+        alpha = sa + da * (1.0 - sa)
+        color = src[..., :3] * sa + dst[..., :3] * (da * (1.0 - sa))
+        color = np.divide(color, alpha, out=np.zeros_like(color), where=alpha > 0)
+        return np.rint(np.concatenate((color, alpha * 255.0), axis=2)).astype(np.uint8)
+
+# the log and time code overlays rendered on their own, as a video track
+# with alpha. the overlays only depend on the log file, the frame times and
+# the overlay config, not on the video pixels, so the track can be rendered
+# once and cached, and then composited onto the video by ffmpeg for every
+# export. the track only covers the area of the frame containing the
+# overlay boxes. cached tracks are named by a hash of everything they
+# depend on
+class OverlayTrack(object):
+    def __init__(self, cfg, timeline, logfile, cachedir):
+        self._cfg = cfg
+        self._timeline = timeline
+        self._logfile = logfile
+        self._panels = OverlayPanels(cfg)
+        self.x = self._panels.x
+        self.y = self._panels.y
+        self.width = self._panels.width
+        self.height = self._panels.height
+        self._path = pathlib.Path(cachedir) / f"overlay-{self.key()}.mov"
+        logging.debug("Created OverlayTrack\n" + str(self))
+
+    def __str__(self):
+        desc = "OverlayTrack:\n"
+        desc += f"path:     {self._path}\n"
+        desc += f"cached:   {self.cached}\n"
+        desc += f"area:     {self.width}x{self.height} at {self.x},{self.y}\n"
+        return desc
+
+    # the cache key is a hash of the log file contents, the frame times
+    # (which include the start timestamp) and the overlay configuration
+    def key(self):
+        digest = hashlib.sha256()
+        digest.update(f"vidlog overlay track {_TRACK_VERSION}\n".encode())
+        with open(self._logfile, "rb") as logfile:
+            for chunk in iter(lambda: logfile.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(self._timeline.wallclock.tobytes())
+        for section in (self._cfg.log, self._cfg.time, self._cfg.filter):
+            digest.update(repr(sorted(dict(section._cfg).items())).encode())
+        return digest.hexdigest()[:24]
+
+    @property
+    def path(self):
+        return str(self._path)
+
+    @property
+    def cached(self):
+        return self._path.is_file()
+
+    # render the overlays for every frame of the video into the track file
+    # the track is written to a temporary name and renamed when complete, so
+    # an interrupted render is never mistaken for a cached track
+    def render(self):
+        logging.info(f"start rendering overlay track {self._path}")
+        timeline = self._timeline
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self._path.with_name(self._path.stem + ".partial.mov")
+        fps = (len(timeline) - 1) / timeline.pts[-1] if timeline.pts[-1] > 0 else 30.0
+        # the log is opened before ffmpeg is started, so a bad log does not
+        # leave ffmpeg waiting for frames
+        lb = LogBuffer(self._logfile, maxlines=self._cfg.log.lines, filtercfg=self._cfg.filter)
+        canvas = self._panels.canvas()
+        if not _quiet:
+            bar = IncrementalBar("Overlay seconds", max=int(timeline.pts[-1]))
+        next_bar = 0.5
+        lines = None
+        try:
+            proc = (ffmpeg
+                    .input("pipe:", format="rawvideo", pix_fmt="bgra",
+                           s=f"{self.width}x{self.height}", framerate=fps)
+                    .output(str(partial), vcodec="qtrle", pix_fmt="argb")
+                    .global_args("-hide_banner", "-loglevel", "info" if _verbose else "error")
+                    .overwrite_output()
+                    .run_async(pipe_stdin=True))
+            try:
+                for framenum, real_time in enumerate(timeline.wallclock):
+                    # the log box only needs to be drawn again when the lines change
+                    lb.update(real_time)
+                    newlines = tuple(lb)
+                    redraw = newlines != lines
+                    lines = newlines
+                    self._panels.draw(canvas, real_time, lines, redraw)
+                    proc.stdin.write(canvas.tobytes())
+                    if not _quiet:
+                        if timeline.pts[framenum] > next_bar:
+                            next_bar += 1
+                            bar.next()
+            finally:
+                proc.stdin.close()
+                proc.wait()
+            if not _quiet:
+                bar.finish()
+            if proc.returncode != 0:
+                raise RuntimeError("An error occured while rendering the overlay track")
+            os.replace(partial, self._path)
+        finally:
+            lb.close()
+            # a track that was not finished is not left behind
+            partial.unlink(missing_ok=True)
+        logging.info("finished rendering overlay track")
+
 # represents the video with log overlays
 class VidLog(object):
-    def __init__(self, vidfile, outfile, start=0, duration=0, cfg=None, gps_time=True):
+    def __init__(self, vidfile, outfile, start=0, duration=0, cfg=None, gps_time=True,
+                 renditions=None, jobs=None, overlay_cache=None):
         self._props = VidProps(vidfile)
         self._vidfile = vidfile
         self._outfile = outfile
+        self._renditions = renditions if renditions else []
+        self._overlay_cache = overlay_cache
+        self._track = None
+        self._log_offset = 0
         self._tmpfile = None
         self._start = start
-        if duration == 0:
+        if not duration:
             self._duration = int(self._props.duration - self._start)
         else:
             self._duration = duration
@@ -295,6 +1056,9 @@ class VidLog(object):
             self._cfg = cfg
         else:
             self._cfg = Config()
+        self._jobs = jobs if jobs else self._cfg.perf.jobs
+        self._gps_track = None
+        self._timeline = None
         if gps_time:
             logging.debug("using GPS time for timestamp")
             self._timestamp = self.extract_gps_timestamp()
@@ -313,6 +1077,11 @@ class VidLog(object):
         desc += f" starting offset: {self._start} secs\n"
         desc += f" output duration: {self._duration} secs\n"
         desc += f" output file:     {self._outfile}\n"
+        for rendition in self._renditions:
+            desc += f" rendition:       {rendition}\n"
+        desc += f" render jobs:     {self._jobs}\n"
+        if self._overlay_cache:
+            desc += f" overlay cache:   {self._overlay_cache}\n"
         desc += f" GPS timestamp:   {self._timestamp}\n"
         desc +=  " GPS time:        "
         desc += datetime.datetime.fromtimestamp(self._timestamp).isoformat(sep=' ')
@@ -323,12 +1092,19 @@ class VidLog(object):
     def timestamp(self):
         return self._timestamp
 
+    # the frame timeline is only built when it is first needed
+    @property
+    def timeline(self):
+        if self._timeline is None:
+            self._timeline = Timeline(self._vidfile, self._timestamp, self._gps_track)
+        return self._timeline
+
     def cleanup(self):
         # remove the temporary file
         if self._tmpfile:
             logging.info("removing temporary video file")
             pathlib.Path(self._tmpfile).unlink(missing_ok=True)
-        else:
+        elif not self._track:
             logging.warning("no temporary video file to delete")
 
     def extract_gps_timestamp(self):
@@ -356,9 +1132,21 @@ class VidLog(object):
         timestr = time_el.text[:-1]  # remove trailing 'Z'
         logging.debug("found GPS timestamp ({time_el.text})")
 
+        # also keep the full GPS time track, for drift correction
+        track = []
+        for trk_el in root.iterfind(".//gpx:trkpt/gpx:time", ns):
+            try:
+                trkdt = datetime.datetime.fromisoformat(trk_el.text.rstrip('Z'))
+            except (AttributeError, ValueError):
+                continue
+            track.append(trkdt.replace(tzinfo=datetime.timezone.utc).timestamp())
+        self._gps_track = track if track else None
+        logging.debug(f"found {len(track)} GPS track points")
+
         # remove the temporary file
         logging.debug("removing GPS temporary file")
         pathlib.Path(tmpfile).unlink(missing_ok=True)
+        pathlib.Path(f"{tmpfile}.gpx").unlink(missing_ok=True)
 
         # convert to timestamp and return
         dt = datetime.datetime.fromisoformat(timestr)
@@ -369,9 +1157,10 @@ class VidLog(object):
         return dt.timestamp()
 
     def add_overlay(self, logfile):
+        if self._overlay_cache:
+            self.add_overlay_track(logfile)
+            return
         logging.info("start add logging overlay")
-        cfg = self._cfg.log  # convenience variable
-        tfg = self._cfg.time
 
         # create a temporary file for the intermediate product
         _, tmpfile = tempfile.mkstemp(suffix=".mp4")
@@ -379,7 +1168,7 @@ class VidLog(object):
         logging.debug(f"overlay temporary video file:\n{tmpfile}")
 
         # open the video capture
-        cap = cv.VideoCapture(self._vidfile)
+        cap = self._cfg.perf.capture(self._vidfile)
         if not cap.isOpened():
             raise RuntimeError(f"error opening input video file {self._vidfile}")
 
@@ -407,97 +1196,244 @@ class VidLog(object):
 
         logging.debug(f"Adding logfile overlay from: {logfile}")
 
-        # create the log buffer
-        lb = LogBuffer(logfile, maxlines=cfg.lines)
-
         if not _quiet:
             bar = IncrementalBar("Seconds processed", max=self._duration)
-            next_bar = (self._start * 1000) + 500
+        else:
+            bar = None
+
+        if self._jobs > 1:
+            # the renderer processes open their own video capture
+            cap.release()
+            self._overlay_parallel(logfile, writer, (height, width, 3), bar)
+        else:
+            self._overlay_serial(logfile, cap, writer, bar)
+            cap.release()
+
+        if bar:
+            bar.finish()
+        logging.info("Finished creating text overlay")
+        writer.release()
+
+    # use a cached overlay track, rendering it first if needed
+    # the track is composited onto the video by ffmpeg in add_dash
+    def add_overlay_track(self, logfile):
+        self._track = OverlayTrack(self._cfg, self.timeline, logfile, self._overlay_cache)
+        if self._track.cached:
+            logging.info(f"using cached overlay track {self._track.path}")
+        else:
+            self._track.render()
+
+    # read, render and write every frame in this process
+    def _overlay_serial(self, logfile, cap, writer, bar):
+        # create the log buffer
+        lb = LogBuffer(logfile, maxlines=self._cfg.log.lines, filtercfg=self._cfg.filter,
+                       offset=self._log_offset)
+        timeline = self.timeline
+        next_bar = self._start + 0.5
 
         # skip ahead N frames to start position
-        if self._start > 0:
-            start_frames = fps * self._start
-            cap.set(cv.CAP_PROP_POS_FRAMES, start_frames)
+        framenum = timeline.frame_at(self._start)
+        stop_frame = timeline.frame_at(self._start + self._duration)
+        if framenum > 0:
+            cap.set(cv.CAP_PROP_POS_FRAMES, framenum)
 
         # iterate over all frames to add text overlay
-        play_time = 0
-        stop_time = (self._start + self._duration) * 1000
-        while play_time < stop_time:
+        # the video time and actual time of each frame come from the timeline
+        while framenum < stop_frame:
             ret, frame = cap.read()
             if not ret:
                 logging.debug("reached end of input video stream")
                 break
 
-            # get the current video time within this file (0-origin)
-            # this is in msec
-            play_time = int(cap.get(cv.CAP_PROP_POS_MSEC)) # gives msec
-            # import pdb; pdb.set_trace()
-
-            # compute the actual time in seconds, in timestamp format
-            real_time = self._timestamp + (play_time / 1000.0)
-
             # maintain progress bar
-            if not _quiet:
-                if play_time > next_bar:
-                    next_bar += 1000
+            if bar:
+                if timeline.pts[framenum] > next_bar:
+                    next_bar += 1
                     bar.next()
 
-            # create box overlay for time code
-            overlay = frame.copy()
-            topleft = (tfg.x, tfg.y)
-            botright = (tfg.x + tfg.width, tfg.y + tfg.height)
-            cv.rectangle(overlay, topleft, botright, tfg.bgcolor, -1)
-            tcframe = cv.addWeighted(overlay, tfg.alpha, frame, 1-tfg.alpha, 0)
-            # get the current position as timestamp
-            # convert to human readable text
-            tcstamp = datetime.datetime.fromtimestamp(real_time)
-            tctext = tcstamp.isoformat(sep=' ')
-            cv.putText(tcframe, tctext,
-                       (tfg.x + tfg.padx, tfg.y + tfg.pady),
-                       tfg.font, tfg.fontscale, tfg.fgcolor, 1, cv.LINE_AA)
-
-            # copy timecode box into output frame
-            frame[       tfg.y:tfg.y+tfg.height, tfg.x:tfg.x+tfg.width] = \
-                 tcframe[tfg.y:tfg.y+tfg.height, tfg.x:tfg.x+tfg.width]
-
-            # create a rectangle overlay for text
-            overlay = frame.copy()
-            topleft = (cfg.x, cfg.y)
-            botright = (cfg.x + cfg.width, cfg.y + cfg.height)
-            cv.rectangle(overlay, topleft, botright, cfg.bgcolor, -1)
-            newframe = cv.addWeighted(overlay, cfg.alpha, frame, 1-cfg.alpha, 0)
-
-            # import pdb; pdb.set_trace()
-            #lb.update(play_time / 1000.0) # convert to seconds timestampt fmt
-            lb.update(real_time)
-
-            # write the text into the overlay box
-            for linenum, text in enumerate(lb):
-                cv.putText(newframe, text,
-                           (cfg.x + cfg.padx,
-                            cfg.y + cfg.pady + (linenum * cfg.lineheight)),
-                            cfg.font, cfg.fontscale, cfg.fgcolor, 1, cv.LINE_AA)
-
-            # at this point we could write newframe to the output and it would
-            # create the video file output with the gray box and text
-            # however the putText can allow the text to overflow the overlay
-            # box. So copy just the overlay box (which will include the text)
-            # back to the original frame. This will have the effect of cropping
-            # any text that overflows the overlay box.
-
-            # copy pixels from one numpy frame to the other
-            frame[       cfg.y:cfg.y+cfg.height, cfg.x:cfg.x+cfg.width] = \
-                newframe[cfg.y:cfg.y+cfg.height, cfg.x:cfg.x+cfg.width]
+            VidLog.draw_overlay(frame, timeline.wallclock[framenum], lb,
+                                self._cfg.log, self._cfg.time)
 
             # save the updated frame
             writer.write(frame)
+            framenum += 1
 
-        if not _quiet:
-            bar.finish()
-        logging.info("Finished creating text overlay")
         lb.close()
-        writer.release()
-        cap.release()
+
+    # decode, render and write frames using separate processes
+    # frames are passed through a ring of shared memory frame slots, so
+    # only the slot index and frame metadata are sent between processes.
+    # a decoder process fills free slots, the renderer processes draw the
+    # overlays in place, and this process writes the frames in order and
+    # returns the slots to the free list
+    def _overlay_parallel(self, logfile, writer, shape, bar):
+        nslots = self._jobs * self._cfg.perf.slots + 2
+        ring = FrameRing(nslots, shape)
+        free_q = mp.Queue()
+        work_q = mp.Queue()
+        done_q = mp.Queue()
+        abort = mp.Event()
+        for slot in range(nslots):
+            free_q.put(slot)
+
+        # config objects are passed to the renderers as plain dicts of the
+        # config items so they can be sent to other processes
+        logcfg = dict(self._cfg.log._cfg)
+        timecfg = dict(self._cfg.time._cfg)
+        filtercfg = dict(self._cfg.filter._cfg)
+        perfcfg = dict(self._cfg.perf._cfg)
+
+        timeline = self.timeline
+        start_frame = timeline.frame_at(self._start)
+        stop_frame = timeline.frame_at(self._start + self._duration)
+
+        logging.debug(f"starting {self._jobs} overlay renderers with {nslots} frame slots")
+        decoder = mp.Process(target=_decode_frames,
+                             args=(ring.name, nslots, shape, self._vidfile,
+                                   start_frame, stop_frame, self._jobs,
+                                   perfcfg, free_q, work_q, abort))
+        renderers = [mp.Process(target=_render_frames,
+                                args=(ring.name, nslots, shape, logfile, self._log_offset,
+                                      timeline.wallclock, logcfg, timecfg,
+                                      filtercfg, work_q, done_q, abort))
+                     for _ in range(self._jobs)]
+        decoder.start()
+        for renderer in renderers:
+            renderer.start()
+
+        try:
+            # frames can be finished out of order by the renderers, so hold
+            # them until all earlier frames have been written
+            pending = {}
+            next_seq = 0
+            next_bar = self._start + 0.5
+            finished = 0
+            while finished < self._jobs:
+                try:
+                    item = done_q.get(timeout=_WORKER_POLL)
+                except queue.Empty:
+                    item = False
+                # a process that died will never send its frames, so stop
+                # instead of waiting for them
+                if decoder.exitcode not in (None, 0):
+                    raise RuntimeError(f"error decoding input video file {self._vidfile}")
+                if any(r.exitcode not in (None, 0) for r in renderers):
+                    raise RuntimeError("An error occured while rendering the log overlay")
+                if item is False:
+                    continue
+                if item is None:
+                    finished += 1
+                    continue
+                seq, slot, framenum = item
+                pending[seq] = (slot, framenum)
+                while next_seq in pending:
+                    slot, framenum = pending.pop(next_seq)
+                    writer.write(ring.frame(slot))
+                    free_q.put(slot)
+                    next_seq += 1
+                    if bar:
+                        if timeline.pts[framenum] > next_bar:
+                            next_bar += 1
+                            bar.next()
+            decoder.join()
+            for renderer in renderers:
+                renderer.join()
+            if decoder.exitcode != 0:
+                raise RuntimeError(f"error decoding input video file {self._vidfile}")
+            if pending or any(r.exitcode != 0 for r in renderers):
+                raise RuntimeError("An error occured while rendering the log overlay")
+        finally:
+            # let the processes stop on their own if they can, otherwise
+            # they could be waiting on a queue that is never filled
+            abort.set()
+            for proc in [decoder] + renderers:
+                proc.join(2 * _WORKER_POLL)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join()
+            ring.close()
+            ring.unlink()
+
+    # draw the time code box and the log text box into a frame
+    # the frame is modified in place
+    @staticmethod
+    def draw_overlay(frame, real_time, lb, cfg, tfg):
+        # create box overlay for time code
+        overlay = frame.copy()
+        topleft = (tfg.x, tfg.y)
+        botright = (tfg.x + tfg.width, tfg.y + tfg.height)
+        cv.rectangle(overlay, topleft, botright, tfg.bgcolor, -1)
+        tcframe = cv.addWeighted(overlay, tfg.alpha, frame, 1-tfg.alpha, 0)
+        # get the current position as timestamp
+        # convert to human readable text
+        tcstamp = datetime.datetime.fromtimestamp(real_time)
+        tctext = tcstamp.isoformat(sep=' ')
+        cv.putText(tcframe, tctext,
+                   (tfg.x + tfg.padx, tfg.y + tfg.pady),
+                   tfg.font, tfg.fontscale, tfg.fgcolor, 1, cv.LINE_AA)
+
+        # copy timecode box into output frame
+        frame[       tfg.y:tfg.y+tfg.height, tfg.x:tfg.x+tfg.width] = \
+             tcframe[tfg.y:tfg.y+tfg.height, tfg.x:tfg.x+tfg.width]
+
+        # create a rectangle overlay for text
+        overlay = frame.copy()
+        topleft = (cfg.x, cfg.y)
+        botright = (cfg.x + cfg.width, cfg.y + cfg.height)
+        cv.rectangle(overlay, topleft, botright, cfg.bgcolor, -1)
+        newframe = cv.addWeighted(overlay, cfg.alpha, frame, 1-cfg.alpha, 0)
+
+        lb.update(real_time)
+
+        # write the text into the overlay box
+        for linenum, text in enumerate(lb):
+            cv.putText(newframe, text,
+                       (cfg.x + cfg.padx,
+                        cfg.y + cfg.pady + (linenum * cfg.lineheight)),
+                        cfg.font, cfg.fontscale, cfg.fgcolor, 1, cv.LINE_AA)
+
+        # at this point we could write newframe to the output and it would
+        # create the video file output with the gray box and text
+        # however the putText can allow the text to overflow the overlay
+        # box. So copy just the overlay box (which will include the text)
+        # back to the original frame. This will have the effect of cropping
+        # any text that overflows the overlay box.
+
+        # copy pixels from one numpy frame to the other
+        frame[       cfg.y:cfg.y+cfg.height, cfg.x:cfg.x+cfg.width] = \
+            newframe[cfg.y:cfg.y+cfg.height, cfg.x:cfg.x+cfg.width]
+
+    # render only the event windows from the video, each one to its own
+    # output file named after the output file, and write a summary index
+    def render_events(self, windows, logfile, dashfile):
+        outpath = pathlib.Path(self._outfile)
+        indexfile = outpath.with_name(f"{outpath.stem}_events.csv")
+        duration = self._props.duration
+        with open(indexfile, "wt", newline="") as index:
+            writer = csv.writer(index)
+            writer.writerow(["file", "time", "offset", "duration", "hits", "rules"])
+            for num, window in enumerate(windows, start=1):
+                # convert the window to whole seconds of video offset
+                start = max(0, math.floor(self.timeline.offset_of(window.start)))
+                end = min(duration, math.ceil(self.timeline.offset_of(window.end)))
+                if end <= start:
+                    logging.info(f"event window is outside of the video: {window}")
+                    continue
+                self._start = start
+                self._duration = int(end - start)
+                self._log_offset = window.offset
+                self._outfile = str(outpath.with_name(f"{outpath.stem}_event{num:03d}{outpath.suffix}"))
+                logging.info(f"rendering event window {num} of {len(windows)} to {self._outfile}")
+                self.add_overlay(logfile)
+                self.add_dash(dashfile)
+                self.cleanup()
+                wintime = datetime.datetime.fromtimestamp(
+                    self.timeline.wallclock[self.timeline.frame_at(start)])
+                writer.writerow([self._outfile, wintime.isoformat(sep=' '), start,
+                                 self._duration, window.hits, " ".join(window.rules)])
+        self._outfile = str(outpath)
+        self._log_offset = 0
+        logging.info(f"event summary written to {indexfile}")
 
     """
     ffmpeg -i $OUTPUT1 -i $INSTFILE -filter_complex "[1:v]scale=400:280 [overlay], [0:v][overlay]overlay=800:20" tempout.mp4
@@ -510,7 +1446,15 @@ class VidLog(object):
         dashts = VidLog.dash_timestamp(dashfile)
         tsoffset = self.timestamp - dashts
         logging.debug(f"Computed dash timestamp offset: {tsoffset}")
-        vid = ffmpeg.input(self._tmpfile, hide_banner=None)
+        if self._track:
+            # composite the overlay track onto the original video
+            vid = ffmpeg.input(self._vidfile, ss=self._start, t=self._duration,
+                               hide_banner=None)
+            track = ffmpeg.input(self._track.path, ss=self._start, t=self._duration)
+            vid = vid.video.overlay(track, eof_action="pass",
+                                    x=str(self._track.x), y=str(self._track.y))
+        else:
+            vid = ffmpeg.input(self._tmpfile, hide_banner=None)
         dash = ffmpeg.input(dashfile, ss=self._start+tsoffset, t=self._duration)
         audio = ffmpeg.input(self._vidfile, ss=self._start, t=self._duration)
         astream = audio.audio
@@ -521,7 +1465,20 @@ class VidLog(object):
         dashy = str(cfg.y)
         #overlaid = vid.overlay(scaled, eof_action="pass", x=dashx, y=dashy, enable="gte(t,5)")
         overlaid = vid.overlay(scaled, eof_action="pass", x=dashx, y=dashy)
-        out = ffmpeg.output(overlaid, astream, self._outfile)
+        if self._renditions:
+            # split the composited stream so that all renditions are encoded
+            # from the same pass instead of decoding the full quality output
+            # again for each reduced copy
+            split = overlaid.split()
+            outs = [ffmpeg.output(split[0], astream, self._outfile,
+                                  **self._cfg.perf.encoder_args())]
+            for idx, rendition in enumerate(self._renditions, start=1):
+                logging.debug(f"adding output rendition {rendition}")
+                outs.append(rendition.output(split[idx], astream))
+            out = ffmpeg.merge_outputs(*outs)
+        else:
+            out = ffmpeg.output(overlaid, astream, self._outfile,
+                                **self._cfg.perf.encoder_args())
         logging.debug("ffmpeg args:")
         logging.debug(out.get_args())
         logging.info("running ffmpeg - this can take a while")
@@ -544,6 +1501,73 @@ class VidLog(object):
 
         return datetime.datetime.fromisoformat(tstr).timestamp()
 
+# get the next item from a queue, or None if the overlay rendering was
+# stopped while waiting for it
+def _get_or_abort(q, abort):
+    while not abort.is_set():
+        try:
+            return q.get(timeout=_WORKER_POLL)
+        except queue.Empty:
+            pass
+    return None
+
+# decoder process for parallel overlay rendering
+# reads frames from the input video directly into free ring slots and
+# passes them to the renderers. one end marker is sent per renderer
+def _decode_frames(ringname, slots, shape, vidfile, start_frame, stop_frame, jobs,
+                   perfcfg, free_q, work_q, abort):
+    ring = FrameRing(slots, shape, name=ringname)
+    cap = PerfConfig(config=perfcfg).capture(vidfile)
+    try:
+        if not cap.isOpened():
+            raise RuntimeError(f"error opening input video file {vidfile}")
+        if start_frame > 0:
+            cap.set(cv.CAP_PROP_POS_FRAMES, start_frame)
+        seq = 0
+        for framenum in range(start_frame, stop_frame):
+            slot = _get_or_abort(free_q, abort)
+            if slot is None:
+                break
+            # decode straight into the shared memory slot
+            ret = cap.read(ring.frame(slot))[0]
+            if not ret:
+                logging.debug("reached end of input video stream")
+                break
+            work_q.put((seq, slot, framenum))
+            seq += 1
+    finally:
+        cap.release()
+        ring.close()
+        for _ in range(jobs):
+            work_q.put(None)
+
+# renderer process for parallel overlay rendering
+# draws the overlays into frames in place in the ring slots. each renderer
+# keeps its own log buffer. frames are taken from the work queue in order so
+# each renderer sees increasing timestamps, and the log buffer content only
+# depends on the timestamp
+def _render_frames(ringname, slots, shape, logfile, logoffset, wallclock, logcfg, timecfg,
+                   filtercfg, work_q, done_q, abort):
+    ring = FrameRing(slots, shape, name=ringname)
+    lb = None
+    try:
+        cfg = LogConfig(config=logcfg)
+        tfg = TimeConfig(config=timecfg)
+        lb = LogBuffer(logfile, maxlines=cfg.lines, filtercfg=FilterConfig(config=filtercfg),
+                       offset=logoffset)
+        while True:
+            item = _get_or_abort(work_q, abort)
+            if item is None:
+                break
+            seq, slot, framenum = item
+            VidLog.draw_overlay(ring.frame(slot), wallclock[framenum], lb, cfg, tfg)
+            done_q.put(item)
+    finally:
+        if lb:
+            lb.close()
+        ring.close()
+        done_q.put(None)
+
 class VidProps(object):
     def __init__(self, vidfile):
         logging.info("starting collecting video properties")
@@ -652,14 +1676,25 @@ def cli():
     parser.add_argument('-d', "--dash", required=True, help="input dash instruments video cap")
     parser.add_argument('-o', "--output", default="processed.mp4",
                         help="output video file (default=processed.mp4)")
+    parser.add_argument('-r', "--rendition", action="append", default=[],
+                        help="additional output, FILE[,size=WxH][,bitrate=RATE][,codec=CODEC]"
+                             " (can be repeated)")
+    parser.add_argument('-j', "--jobs", type=int,
+                        help="number of overlay renderer processes (default: from profile, or 1)")
+    parser.add_argument("--overlay-cache", metavar="DIR",
+                        help="render the overlays once to a cached alpha track in DIR")
     parser.add_argument('-t', "--duration", type=int, help="duration in seconds")
     parser.add_argument('-ss', "--start", type=int, default=0, help="start position in seconds")
     parser.add_argument("--config-name", type=str, default="vidlog.ini",
                         help="specify config file name (default: vidlog.ini)")
+    parser.add_argument("--profile", type=str,
+                        help="performance profile (default: the profile for this machine)")
     parser.add_argument("--bad-gps", action="store_true",
                         help="dont use GPS for time, use file time instead")
     parser.add_argument("--check-timestamps", action="store_true",
                         help="check file timestamps and exit")
+    parser.add_argument("--events", action="store_true",
+                        help="render only the event windows found in the log")
 
     args = parser.parse_args()
 
@@ -680,18 +1715,37 @@ def cli():
 
     logging.info("If you dont want to see these messages, use --quiet")
 
+    # use the performance profile saved by vidlog-tune for this machine
+    # unless a profile is specified
+    profile = args.profile
+    if profile is None and profile_path().is_file():
+        profile = str(profile_path())
+    if profile:
+        if not os.path.isfile(profile):
+            parser.error(f"profile {profile} does not exist")
+        logging.info(f"Using performance profile {profile}")
+
     # check for existence of config file
     if os.path.isfile(args.config_name):
         logging.debug("Found existing config file")
-        cfg = Config(args.config_name)
+        cfg = Config(args.config_name, profile=profile)
     else:
         print("\n*** MISSING CONFIGURATION FILE! USING DEFAULTS ***")
         print("you can generate a config file with vidlog-init-config\n")
-        cfg = Config()
+        cfg = Config(profile=profile)
         logging.debug("did not find existing config file")
 
+    try:
+        renditions = [OutputSpec(spec) for spec in args.rendition]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.events and renditions:
+        parser.error("--rendition can not be used with --events")
+
     vid = VidLog(vidfile=args.input, outfile=args.output, start=args.start,
-                 duration=args.duration, gps_time=not args.bad_gps, cfg=cfg)
+                 duration=args.duration, gps_time=not args.bad_gps, cfg=cfg,
+                 renditions=renditions, jobs=max(1, args.jobs) if args.jobs else None,
+                 overlay_cache=args.overlay_cache)
 
     if args.check_timestamps:
         vid_ts = datetime.datetime.fromtimestamp(vid.timestamp).isoformat(sep=' ')
@@ -703,6 +1757,12 @@ def cli():
         print(f"Dash Timestamp:  {dash_ts}")
         sys.exit()
 
+    if args.events:
+        scanner = EventScanner(args.logfile, cfg.events, cfg.log.lines, cfg.filter)
+        windows = scanner.scan()
+        vid.render_events(windows, args.logfile, args.dash)
+        sys.exit()
+
     vid.add_overlay(args.logfile)
     vid.add_dash(args.dash)
     vid.cleanup()